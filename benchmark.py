@@ -0,0 +1,389 @@
+import argparse
+import asyncio
+import collections
+import configparser
+import datetime
+import gzip
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from main import upload_file, upload_translated, create_default_config, _attach_upload_pool, _create_http_session
+from gcode_translate import translate_gcode, TRANSLATE_ENGINES
+from offset_template import compile_template
+from gcode_moves import moves_cache_path
+from gcode_files import GZIP_LEVEL
+from mock_moonraker import start_mock_moonraker
+
+_SIZE_UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+def parse_size(text):
+    text = text.strip().upper()
+    for unit, factor in _SIZE_UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+def _format_size(size):
+    for unit in ('GB', 'MB', 'KB'):
+        if size >= _SIZE_UNITS[unit]:
+            return f"{size / _SIZE_UNITS[unit]:g}{unit}"
+    return f"{size}B"
+
+def _layer_lines(rng, layer, z, center_x, center_y):
+    lines = [f";LAYER:{layer}\n", f"G1 Z{z:.2f} F600\n"]
+
+    # Perimeters: a few loops around the part, partly as arcs
+    radius = 20 + rng.uniform(-0.5, 0.5)
+    for loop in range(3):
+        r = radius - loop * 0.45
+        lines.append(";TYPE:WALL-OUTER\n" if loop == 0 else ";TYPE:WALL-INNER\n")
+        lines.append("G1 E-0.8 F2400\n")
+        lines.append(f"G0 F9000 X{center_x + r:.3f} Y{center_y:.3f}\n")
+        lines.append("G1 E0.8 F2400\n")
+        segments = 64
+        for i in range(1, segments + 1):
+            angle = 2 * math.pi * i / segments
+            x = center_x + r * math.cos(angle)
+            y = center_y + r * math.sin(angle)
+            if i % 16 == 0:
+                lines.append(f"G2 X{x:.3f} Y{y:.3f} I{-r * math.cos(angle):.3f} J{-r * math.sin(angle):.3f} E{0.0421:.5f}\n")
+            else:
+                lines.append(f"G1 X{x:.3f} Y{y:.3f} E{rng.uniform(0.02, 0.05):.5f}\n")
+
+    # Zig-zag infill
+    lines.append(";TYPE:FILL\n")
+    step = 2.0 if layer % 2 else 2.5
+    y = center_y - radius + 1
+    direction = 1
+    while y < center_y + radius - 1:
+        half = math.sqrt(max(radius ** 2 - (y - center_y) ** 2, 0)) - 1
+        lines.append(f"G1 X{center_x - direction * half:.3f} Y{y:.3f} F4800\n")
+        lines.append(f"G1 X{center_x + direction * half:.3f} Y{y:.3f} E{half * 0.066:.5f}\n")
+        direction = -direction
+        y += step
+    return lines
+
+def _tool_change_lines(tool, layer):
+    # Palette-style splice bookkeeping around a tool change
+    return [
+        f"; Palette 2 splice for layer {layer}\n",
+        "G1 E-0.8 F2400\n",
+        "M400\n",
+        f"T{tool}\n",
+        "G4 P0\n",
+        f"M117 Ping {layer}\n",
+        "G1 E0.8 F2400\n",
+    ]
+
+def generate_gcode(output_file_path, target_size, seed=0):
+    # Write a synthetic Canvas/Palette style G-code file of roughly target_size
+    # bytes and return the number of lines written
+    rng = random.Random(seed)
+    header = [
+        "; G-code generated by Canvas (synthetic benchmark file)\n",
+        "; Palette 2 multi-material print\n",
+        "M104 S210\n", "M140 S60\n", "M190 S60\n", "M109 S210\n",
+        "G21\n", "G90\n", "M82\n", "G28\n", "G92 E0\n", "T0\n",
+    ]
+    size = 0
+    line_count = 0
+    layer = 0
+    tool = 0
+    with open(output_file_path, 'w', buffering=1024 * 1024) as file:
+        file.write(''.join(header))
+        size += sum(len(line) for line in header)
+        line_count += len(header)
+        while size < target_size:
+            layer += 1
+            batch = []
+            if layer % 5 == 0:
+                tool = (tool + 1) % 4
+                batch.extend(_tool_change_lines(tool, layer))
+            batch.extend(_layer_lines(rng, layer, 0.2 * layer, 110 + rng.uniform(-1, 1), 110 + rng.uniform(-1, 1)))
+            text = ''.join(batch)
+            file.write(text)
+            size += len(text)
+            line_count += len(batch)
+        file.write("M107\nM104 S0\nM140 S0\nG28 X0\nM84\n")
+        line_count += 5
+    return line_count
+
+def _result(benchmark, size_bytes, seconds, **extra):
+    result = {
+        'benchmark': benchmark,
+        'size_bytes': size_bytes,
+        'seconds': round(seconds, 4),
+        'mb_per_s': round(size_bytes / 1e6 / max(seconds, 1e-9), 2),
+    }
+    result.update(extra)
+    return result
+
+def bench_translate(input_file_path, line_count, workdir, workers):
+    results = []
+    size = os.path.getsize(input_file_path)
+    output_file_path = os.path.join(workdir, 'translated.gcode')
+    for engine in TRANSLATE_ENGINES:
+        start_time = time.perf_counter()
+        translate_gcode(input_file_path, output_file_path, 80.0, 80.0, engine, workers)
+        seconds = time.perf_counter() - start_time
+        results.append(_result('translate', size, seconds, engine=engine, workers=workers,
+                               lines=line_count, lines_per_s=round(line_count / max(seconds, 1e-9))))
+
+        # Compiling once and rendering at another offset is what the GUI does
+        # when a file is fixed again
+        start_time = time.perf_counter()
+        template = compile_template(input_file_path, engine)
+        results.append(_result('template_compile', size, time.perf_counter() - start_time, engine=engine))
+        start_time = time.perf_counter()
+        template.write(output_file_path, 75.0, 85.0)
+        results.append(_result('template_render', size, time.perf_counter() - start_time, engine=engine))
+        del template
+
+    # gzip compressed input and output, decompressed and compressed on the fly
+    compressed_input_path = input_file_path + '.gz'
+    with open(input_file_path, 'rb') as infile, gzip.open(compressed_input_path, 'wb', compresslevel=GZIP_LEVEL) as outfile:
+        shutil.copyfileobj(infile, outfile, 1024 * 1024)
+    start_time = time.perf_counter()
+    translate_gcode(compressed_input_path, output_file_path + '.gz', 80.0, 80.0, 'fast', workers)
+    results.append(_result('translate_gzip', size, time.perf_counter() - start_time, engine='fast',
+                           compressed_bytes=os.path.getsize(compressed_input_path)))
+    os.remove(compressed_input_path)
+    os.remove(output_file_path + '.gz')
+    os.remove(output_file_path)
+    return results
+
+def bench_viewer(input_file_path):
+    # The viewer needs a QApplication; run it without a display
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PySide6.QtWidgets import QApplication
+        from PySide6.QtCore import QPointF
+        from main_interactive import GCodeViewer
+    except ImportError as e:
+        logging.warning(f"Skipping viewer benchmark: {e}")
+        return []
+
+    app = QApplication.instance() or QApplication([])
+    viewer = GCodeViewer()
+    viewer.resize(800, 800)
+    start_time = time.perf_counter()
+    viewer.load_gcode(input_file_path)
+    seconds = time.perf_counter() - start_time
+    results = [_result('viewer_load', os.path.getsize(input_file_path), seconds)]
+
+    # The first load saved the parsed moves, reopening maps them back in
+    start_time = time.perf_counter()
+    viewer.load_gcode(input_file_path)
+    results.append(_result('viewer_reload', os.path.getsize(input_file_path), time.perf_counter() - start_time))
+
+    # Zoomed into one corner of the print, where the whole toolpath is larger
+    # than the view: with the spatial index only the moves around the view
+    # are rendered, without it the whole toolpath is. Every paint starts
+    # without a cached pixmap.
+    viewer.scale_factor = 40.0
+    viewer.gcode_offset = QPointF(viewer.bed_size[0] / 2 - viewer.min_x, viewer.bed_size[1] / 2 - viewer.min_y)
+    grid = viewer._segment_grid
+    for culled in (True, False):
+        viewer._segment_grid = grid if culled else None
+        viewer._cache_scale = None
+        start_time = time.perf_counter()
+        viewer.grab()
+        results.append(_result('viewer_zoomed_paint', os.path.getsize(input_file_path), time.perf_counter() - start_time, culled=culled))
+
+    # A short drag at that zoom level reuses the pixmap rendered around the view
+    viewer._segment_grid = grid
+    viewer.grab()
+    viewer.gcode_offset += QPointF(1.0, 1.0)
+    start_time = time.perf_counter()
+    viewer.grab()
+    results.append(_result('viewer_zoomed_drag', os.path.getsize(input_file_path), time.perf_counter() - start_time))
+    return results
+
+async def bench_upload(input_file_path, workdir):
+    runner, base_url = await start_mock_moonraker()
+    client = types.SimpleNamespace(_base_url=base_url)
+    _attach_upload_pool(client, _create_http_session(2))
+    size = os.path.getsize(input_file_path)
+    results = []
+    try:
+        start_time = time.perf_counter()
+        await upload_file(client, input_file_path)
+        results.append(_result('upload_file', size, time.perf_counter() - start_time))
+
+        for engine in TRANSLATE_ENGINES:
+            output_file_path = os.path.join(workdir, 'streamed.gcode')
+            start_time = time.perf_counter()
+            await upload_translated(client, input_file_path, output_file_path, 80.0, 80.0, engine, keep_copy=False)
+            results.append(_result('upload_translated', size, time.perf_counter() - start_time, engine=engine))
+    finally:
+        await client.session.close()
+        await runner.cleanup()
+    return results
+
+# Cold start of the entry points, each measured in a fresh interpreter: the
+# import of the module and what it does before it is ready for work. The CLI
+# is a run over an empty fixme directory with uploads off, like a cron
+# invocation of the watcher; the GUI is the main window shown once.
+_STARTUP_SNIPPET = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{init}
+print(json.dumps({{'import_seconds': imported - start, 'init_seconds': time.perf_counter() - imported}}))
+'''
+
+STARTUP_TARGETS = {
+    'cli': ('main', "main.main()"),
+    'gui': ('main_interactive', "from PySide6.QtWidgets import QApplication\n"
+                                "app = QApplication([])\n"
+                                "window = main_interactive.MainWindow()\n"
+                                "window.show()\n"
+                                "app.processEvents()"),
+}
+
+# Top-level packages that should only be imported once something is uploaded
+NETWORK_PACKAGES = ('aiohttp', 'moonraker_api')
+
+def _parse_importtime(stderr):
+    # Sum the self time of every imported module (in ms) per top-level package
+    packages = collections.Counter()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(self_us) / 1000
+    return packages
+
+def bench_startup(runs=3, top=15):
+    package_directory = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (package_directory, os.environ.get('PYTHONPATH')))))
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    results = []
+    for target, (module, init) in STARTUP_TARGETS.items():
+        best = None
+        with tempfile.TemporaryDirectory() as workdir:
+            config_file_path = os.path.join(workdir, 'config.ini')
+            create_default_config(config_file_path)
+            config = configparser.ConfigParser()
+            config.read(config_file_path)
+            config.set('Moonraker', 'auto_upload', 'false')
+            config.set('Moonraker', 'auto_start_print', 'false')
+            with open(config_file_path, 'w') as file:
+                config.write(file)
+            os.makedirs(os.path.join(workdir, 'fixme'))
+            for _ in range(runs):
+                process = subprocess.run([sys.executable, '-X', 'importtime', '-c', _STARTUP_SNIPPET.format(module=module, init=init)],
+                                         cwd=workdir, env=env, capture_output=True, text=True)
+                if process.returncode != 0:
+                    logging.warning(f"Skipping {target} startup benchmark: {process.stderr.strip().splitlines()[-1:]}")
+                    break
+                timings = json.loads(process.stdout.strip().splitlines()[-1])
+                if best is None or sum(timings.values()) < sum(best[0].values()):
+                    best = (timings, _parse_importtime(process.stderr))
+        if best is None or process.returncode != 0:
+            continue
+
+        timings, packages = best
+        seconds = timings['import_seconds'] + timings['init_seconds']
+        results.append({
+            'benchmark': 'startup',
+            'entry_point': target,
+            'seconds': round(seconds, 4),
+            'import_seconds': round(timings['import_seconds'], 4),
+            'init_seconds': round(timings['init_seconds'], 4),
+            'network_stack_loaded': any(package in packages for package in NETWORK_PACKAGES),
+            'modules': [{'module': name, 'ms': round(ms, 1)} for name, ms in packages.most_common(top)],
+        })
+    return results
+
+def _version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run_benchmarks(sizes, workdir, workers=1, viewer=True, upload=True, seed=0):
+    results = []
+    for size in sizes:
+        input_file_path = os.path.join(workdir, f"synthetic_{_format_size(size)}.gcode")
+        logging.info(f"Generating {_format_size(size)} of synthetic G-code")
+        line_count = generate_gcode(input_file_path, size, seed)
+        actual_size = os.path.getsize(input_file_path)
+
+        results.extend(bench_translate(input_file_path, line_count, workdir, workers))
+        if viewer:
+            # Load in a child process so a crash in the Qt bindings only loses this result
+            try:
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    results.extend(pool.submit(bench_viewer, input_file_path).result())
+            except BrokenProcessPool:
+                logging.error("Viewer benchmark process crashed")
+        if upload:
+            results.extend(asyncio.run(bench_upload(input_file_path, workdir)))
+
+        for result in results:
+            result.setdefault('input', _format_size(size))
+            result.setdefault('input_bytes', actual_size)
+        os.remove(input_file_path)
+        if os.path.exists(moves_cache_path(input_file_path)):
+            os.remove(moves_cache_path(input_file_path))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark G-code translation, viewer loading and uploads on synthetic files.")
+    parser.add_argument('--sizes', default='1MB,10MB,100MB', help="Comma-separated input sizes, e.g. 1MB,100MB,1GB")
+    parser.add_argument('--output', default='benchmark_results.json', help="Where to write the JSON results")
+    parser.add_argument('--workdir', default=None, help="Directory for the generated files (defaults to a temp dir)")
+    parser.add_argument('--workers', type=int, default=1, help="translate_workers passed to translate_gcode")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-viewer', action='store_true')
+    parser.add_argument('--skip-upload', action='store_true')
+    parser.add_argument('--startup', action='store_true', help="Measure cold start of the CLI and GUI instead, with the import cost per package")
+    parser.add_argument('--runs', type=int, default=3, help="Startup runs per entry point, the fastest is reported")
+    args = parser.parse_args()
+
+    if args.startup:
+        results = bench_startup(args.runs)
+    else:
+        sizes = [parse_size(size) for size in args.sizes.split(',') if size.strip()]
+        with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+            results = run_benchmarks(sizes, workdir, args.workers, not args.skip_viewer, not args.skip_upload, args.seed)
+
+    report = {
+        'version': _version(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    for result in results:
+        if result['benchmark'] == 'startup':
+            print(f"{result['entry_point']} startup: {result['seconds']:.3f}s (import {result['import_seconds']:.3f}s, "
+                  f"init {result['init_seconds']:.3f}s, network stack {'loaded' if result['network_stack_loaded'] else 'not loaded'})")
+            for module in result['modules']:
+                print(f"    {module['module']:<24} {module['ms']:8.1f} ms")
+            continue
+        extra = f" ({result['engine']})" if 'engine' in result else ""
+        print(f"{result['input']:>8} {result['benchmark']}{extra}: {result['seconds']:.3f}s, {result['mb_per_s']} MB/s")
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import gzip
+import os
+
+# G-code can be read and written gzip (.gcode.gz) or zstd (.gcode.zst)
+# compressed. Compressed files are always streamed, never decompressed to a
+# temporary file. zstd needs the optional zstandard package.
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+GCODE_SUFFIXES = ('.gcode', '.gcode.gz', '.gcode.zst')
+
+# What the viewer parses out of a G-code file is saved next to it under these
+# suffixes (see gcode_moves and layer_index), and moves along with it
+MOVES_CACHE_SUFFIX = '.moves'
+LAYER_INDEX_SUFFIX = '.layers.json'
+SIDECAR_SUFFIXES = (MOVES_CACHE_SUFFIX, LAYER_INDEX_SUFFIX)
+
+# Fast levels: compression runs while translating, so it should keep up with it
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+def is_gcode_file(file_name):
+    return file_name.endswith(GCODE_SUFFIXES)
+
+def compression_of(file_path):
+    # The compression of a file going by its name, None for plain files
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if file_path.endswith(suffix):
+            return compression
+    return None
+
+def strip_compression(file_name):
+    compression = compression_of(file_name)
+    return file_name[:-len(COMPRESSION_SUFFIXES[compression])] if compression else file_name
+
+def parse_compression(text):
+    # The [Script] fixed_compression setting: none, gzip or zstd
+    text = text.strip().lower()
+    if text in ('', 'none'):
+        return None
+    if text not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown compression: {text}. Expected none or one of {', '.join(COMPRESSION_SUFFIXES)}")
+    return text
+
+def compression_suffix(compression):
+    return COMPRESSION_SUFFIXES[compression] if compression else ''
+
+def open_gcode(file_path, mode='rb', buffering=-1):
+    # Open a G-code file for reading or writing ('r', 'w', 'rb' or 'wb'),
+    # compressing or decompressing on the fly when its name says so
+    compression = compression_of(file_path)
+    if compression is None:
+        return open(file_path, mode, buffering=buffering)
+    text_mode = 'b' not in mode
+    mode = mode.replace('b', '') + ('t' if text_mode else 'b')
+    if compression == 'gzip':
+        return gzip.open(file_path, mode, compresslevel=GZIP_LEVEL)
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError(f"Cannot open {os.path.basename(file_path)}: zstd compressed G-code needs the zstandard package (pip install zstandard)")
+    return zstandard.open(file_path, mode, cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL))
+
+def move_gcode_file(file_path, destination_path):
+    # Move a G-code file and the sidecars it has
+    os.rename(file_path, destination_path)
+    for suffix in SIDECAR_SUFFIXES:
+        try:
+            os.rename(file_path + suffix, destination_path + suffix)
+        except FileNotFoundError:
+            pass
+
+def gcode_size(file_path, block_size=1024 * 1024):
+    # Size of the G-code itself, which for a compressed file means reading it
+    # through once
+    if compression_of(file_path) is None:
+        return os.path.getsize(file_path)
+    size = 0
+    with open_gcode(file_path, 'rb') as file:
+        while True:
+            block = file.read(block_size)
+            if not block:
+                break
+            size += len(block)
+    return size
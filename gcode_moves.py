@@ -0,0 +1,177 @@
+import logging
+import os
+import struct
+
+import numpy as np
+
+from gcode_translate import read_line_chunks, TRANSLATE_BUFFER_SIZE
+from gcode_files import MOVES_CACHE_SUFFIX
+from move_fields import MoveFields
+
+def move_points(fields, last_point):
+    # Return the XY position after every movement line of a MoveFields block
+    # as a float32 (n, 2) array. Coordinates are modal, so a move that only
+    # sets X keeps the previous Y (starting from last_point for the first move
+    # of the block).
+    xs, ys = fields.positions(fields.values())
+    return np.column_stack((_fill_forward(xs, last_point[0]), _fill_forward(ys, last_point[1]))).astype(np.float32)
+
+def _fill_forward(values, initial):
+    # Replace each NaN with the closest preceding value, or initial if there is none
+    missing = np.isnan(values)
+    if not missing.any():
+        return values
+    values = np.concatenate(([initial], values))
+    index = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(index, out=index)
+    return values[index][1:]
+
+# Parsed moves are saved next to the file as <file>.moves: this header (magic,
+# format version, size and mtime of the G-code file, number of moves) followed
+# by the raw float32 XY pairs, so reopening an unchanged file maps them
+# straight from the page cache instead of parsing it again
+MOVES_CACHE_VERSION = 2
+_MOVES_CACHE_MAGIC = b'CVSMOVES'
+_MOVES_CACHE_HEADER = struct.Struct('<8sIqqq')
+
+def moves_cache_path(file_path):
+    return file_path + MOVES_CACHE_SUFFIX
+
+def open_cached_moves(file_path):
+    # Return the saved moves of file_path as a read-only memory-mapped (n, 2)
+    # float32 array, or None when there are none or the file has changed
+    cache_path = moves_cache_path(file_path)
+    try:
+        stat = os.stat(file_path)
+        with open(cache_path, 'rb') as file:
+            header = file.read(_MOVES_CACHE_HEADER.size)
+            cache_size = os.fstat(file.fileno()).st_size
+    except FileNotFoundError:
+        return None
+    if len(header) != _MOVES_CACHE_HEADER.size:
+        return None
+    magic, version, size, mtime_ns, count = _MOVES_CACHE_HEADER.unpack(header)
+    if magic != _MOVES_CACHE_MAGIC or version != MOVES_CACHE_VERSION \
+            or size != stat.st_size or mtime_ns != stat.st_mtime_ns \
+            or cache_size != _MOVES_CACHE_HEADER.size + count * 8:
+        return None
+    if not count:
+        return np.empty((0, 2), dtype=np.float32)
+    return np.memmap(cache_path, dtype=np.float32, mode='r', offset=_MOVES_CACHE_HEADER.size, shape=(count, 2))
+
+class _MovesCacheWriter:
+    # Writes parsed moves to a temporary file as they come in and moves it in
+    # place of the sidecar once the whole file was parsed
+    def __init__(self, file_path):
+        stat = os.stat(file_path)
+        self.source = (stat.st_size, stat.st_mtime_ns)
+        self.cache_path = moves_cache_path(file_path)
+        self.temp_path = self.cache_path + '.tmp'
+        self.file = open(self.temp_path, 'wb')
+        self.file.write(_MOVES_CACHE_HEADER.pack(_MOVES_CACHE_MAGIC, MOVES_CACHE_VERSION, *self.source, 0))
+        self.count = 0
+
+    def write(self, points):
+        self.file.write(np.ascontiguousarray(points, dtype=np.float32))
+        self.count += len(points)
+
+    def commit(self):
+        self.file.seek(0)
+        self.file.write(_MOVES_CACHE_HEADER.pack(_MOVES_CACHE_MAGIC, MOVES_CACHE_VERSION, *self.source, self.count))
+        self.file.close()
+        os.replace(self.temp_path, self.cache_path)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+def _create_moves_cache_writer(file_path):
+    try:
+        return _MovesCacheWriter(file_path)
+    except OSError as e:
+        logging.warning(f"Not caching parsed moves of {file_path}: {e}")
+        return None
+
+class _RangeReader:
+    # File-like view of the bytes between start and end of an open file
+    def __init__(self, file, start, end):
+        file.seek(start)
+        self.file = file
+        self.remaining = end - start
+
+    def read(self, size):
+        block = self.file.read(min(size, self.remaining))
+        self.remaining -= len(block)
+        return block
+
+def iter_move_chunks(file_path, chunk_size=TRANSLATE_BUFFER_SIZE, ranges=None, cache=False):
+    # Yield (points, bytes_read) pairs while reading file_path, where points is
+    # a float32 (n, 2) array with one XY position per G0/G1 move. ranges, when
+    # given, is a list of line-aligned (start, end, start_point) byte ranges to
+    # read instead of the whole file; start_point is the XY position the
+    # printer is at when the range begins (see layer_index). With cache set, a
+    # whole-file read comes from the <file>.moves sidecar in a single batch
+    # when it is up to date, and writes a new one otherwise.
+    if cache and ranges is None:
+        points = open_cached_moves(file_path)
+        if points is not None:
+            yield points, os.path.getsize(file_path)
+            return
+        writer = _create_moves_cache_writer(file_path)
+        if writer is not None:
+            yield from _iter_and_cache(file_path, chunk_size, writer)
+            return
+
+    bytes_read = 0
+    with open(file_path, 'rb') as file:
+        if ranges is None:
+            ranges = [(0, os.fstat(file.fileno()).st_size, (0.0, 0.0))]
+        for start, end, start_point in ranges:
+            last_point = tuple(start_point)
+            for chunk in read_line_chunks(_RangeReader(file, start, end), chunk_size):
+                bytes_read += len(chunk)
+                points = move_points(MoveFields(chunk), last_point)
+                if len(points):
+                    last_point = tuple(points[-1].tolist())
+                yield points, bytes_read
+
+def _iter_and_cache(file_path, chunk_size, writer):
+    # Failing to write the sidecar never stops the moves from being read
+    try:
+        for points, bytes_read in iter_move_chunks(file_path, chunk_size):
+            if writer is not None:
+                try:
+                    writer.write(points)
+                except OSError as e:
+                    logging.warning(f"Not caching parsed moves of {file_path}: {e}")
+                    writer.discard()
+                    writer = None
+            yield points, bytes_read
+        if writer is not None:
+            try:
+                writer.commit()
+                writer = None
+            except OSError as e:
+                logging.warning(f"Not caching parsed moves of {file_path}: {e}")
+    finally:
+        if writer is not None:
+            writer.discard()
+
+def load_moves(file_path, ranges=None, cache=False):
+    chunks = [points for points, _ in iter_move_chunks(file_path, ranges=ranges, cache=cache)]
+    if not chunks:
+        return np.empty((0, 2), dtype=np.float32)
+    if len(chunks) == 1:
+        return chunks[0]  # Keeps a memory-mapped cache hit mapped
+    return np.concatenate(chunks)
+
+def move_bounds(points):
+    # (min_x, min_y, max_x, max_y) of an (n, 2) point array
+    if not len(points):
+        return float('inf'), float('inf'), float('-inf'), float('-inf')
+    min_x, min_y = points.min(axis=0).tolist()
+    max_x, max_y = points.max(axis=0).tolist()
+    return min_x, min_y, max_x, max_y
@@ -0,0 +1,384 @@
+import collections
+import io
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from gcode_files import open_gcode, compression_of
+
+# Translating G-code by an XY offset, and the stats of the translated file.
+# Shared by the command line (main.py), the GUI, the translation service and
+# the modules that parse moves out of G-code.
+
+# Size of the buffered reads and writes used while translating. Large enough to
+# keep syscalls rare, small enough that memory stays flat for huge files.
+TRANSLATE_BUFFER_SIZE = 1024 * 1024
+
+# Files of at least PARALLEL_MIN_SIZE bytes are split into line-aligned ranges
+# of about PARALLEL_RANGE_SIZE bytes and translated on several processes when
+# [Script] translate_workers is above 1. Smaller files are not worth the overhead.
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+PARALLEL_RANGE_SIZE = 16 * 1024 * 1024
+
+def _translate_lines(lines, x_offset, y_offset):
+    new_lines = []
+    for line in lines:
+        if line.startswith(('G0', 'G1')):  # Check for movement commands
+            parts = line.split()
+            new_parts = []
+            for part in parts:
+                if part.startswith('X'):
+                    x_value = float(part[1:])
+                    new_x_value = x_value + x_offset  # Add the offset instead of subtracting
+                    new_parts.append(f'X{new_x_value:.3f}')
+                elif part.startswith('Y'):
+                    y_value = float(part[1:])
+                    new_y_value = y_value + y_offset  # Add the offset instead of subtracting
+                    new_parts.append(f'Y{new_y_value:.3f}')
+                else:
+                    new_parts.append(part)
+            new_lines.append(' '.join(new_parts) + '\n')
+        else:
+            new_lines.append(line)
+    return ''.join(new_lines)
+
+# Translation engines selectable through [Script] translate_engine. "legacy"
+# re-joins every movement line from its tokens; "fast" rewrites only the X/Y
+# fields of G0/G1 lines in place and leaves every other byte untouched.
+TRANSLATE_ENGINES = ('legacy', 'fast')
+
+# The fast engine finds, parses and formats the X/Y values with NumPy (see
+# move_fields), which like the network stack of main.py is only imported once
+# it is needed, so starting up without translating anything does not load it
+
+# Print bed the translated toolpath has to stay on, in mm
+BED_SIZE = (220, 220)
+
+class TranslationStats:
+    # What a translated file does: XY bounds, number of XY moves and extruding
+    # moves, layer heights and tool changes. The fast engine and the offset
+    # template add the moves they have already parsed (see add), anything else
+    # is fed the translated output and parses it once. Fed chunks can be cut
+    # anywhere, the partial last line of each one is kept for the next.
+    # Layers are the heights extruding moves are made at, so Z hops and
+    # travel-only lifts do not count.
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.min_x = self.min_y = float('inf')
+        self.max_x = self.max_y = float('-inf')
+        self.moves = 0
+        self.extrusions = 0
+        self.layer_heights = set()
+        self.z = math.nan  # Height in effect at the end, NaN before the first Z
+        # Whether something was extruded before the first Z, at the height the
+        # output before this one ends at (see merge)
+        self.extrudes_before_z = False
+        self.first_tool = None
+        self.tool = None
+        self.tool_changes = 0
+        self._remainder = b''
+
+    def feed(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        elif not isinstance(chunk, bytes):
+            chunk = bytes(chunk)
+        data = self._remainder + chunk
+        cut = data.rfind(b'\n') + 1
+        self._remainder = data[cut:]
+        if cut:
+            self._scan(data[:cut])
+
+    def finish(self):
+        if self._remainder:
+            self._scan(self._remainder)
+            self._remainder = b''
+        return self
+
+    def _scan(self, data):
+        from move_fields import MoveFields
+        fields = MoveFields(data)
+        self.add(fields, fields.values())
+
+    def add(self, fields, values):
+        # Add a block of whole lines parsed into MoveFields, with values the
+        # X/Y values of its fields as they are written out
+        min_x, min_y, max_x, max_y = fields.bounds(values)
+        self.min_x, self.min_y = min(self.min_x, min_x), min(self.min_y, min_y)
+        self.max_x, self.max_y = max(self.max_x, max_x), max(self.max_y, max_y)
+        self.moves += len(fields.move_lines)
+        extruding = fields.extruding()
+        heights, _ = fields.heights(self.z)
+        self.extrusions += int(extruding.sum())
+        for height in set(heights[extruding].tolist()):
+            if math.isnan(height):
+                self.extrudes_before_z = True
+            else:
+                self.layer_heights.add(height)
+        if len(heights):
+            self.z = float(heights[-1])
+        for tool in fields.tools():
+            if tool != self.tool:
+                if self.tool is not None:
+                    self.tool_changes += 1
+                else:
+                    self.first_tool = tool
+                self.tool = tool
+
+    def merge(self, other):
+        # Add the stats of the output that follows this one
+        other.finish()
+        self.min_x, self.min_y = min(self.min_x, other.min_x), min(self.min_y, other.min_y)
+        self.max_x, self.max_y = max(self.max_x, other.max_x), max(self.max_y, other.max_y)
+        self.moves += other.moves
+        self.extrusions += other.extrusions
+        self.layer_heights |= other.layer_heights
+        if other.extrudes_before_z:
+            if math.isnan(self.z):
+                self.extrudes_before_z = True
+            else:
+                self.layer_heights.add(self.z)
+        if not math.isnan(other.z):
+            self.z = other.z
+        self.tool_changes += other.tool_changes
+        if other.first_tool is not None:
+            if self.tool is not None and other.first_tool != self.tool:
+                self.tool_changes += 1
+            self.tool = other.tool
+            if self.first_tool is None:
+                self.first_tool = other.first_tool
+
+    def summary(self, x_offset=0.0, y_offset=0.0):
+        # With offsets, the bounds are moved by them, for stats collected on
+        # the file before it was translated
+        has_moves = bool(self.moves)
+        return {
+            'bounds': [self.min_x + x_offset, self.min_y + y_offset, self.max_x + x_offset, self.max_y + y_offset] if has_moves else None,
+            'moves': self.moves,
+            'extrusions': self.extrusions,
+            'layers': len(self.layer_heights),
+            'max_z': max(self.layer_heights) if self.layer_heights else None,
+            'tool_changes': self.tool_changes,
+        }
+
+# Summaries are plain dicts so they can be stored in the translation cache
+# and written next to the translated file as JSON
+
+def summary_fits_bed(summary, bed_size=BED_SIZE):
+    if summary['bounds'] is None:
+        return True
+    min_x, min_y, max_x, max_y = summary['bounds']
+    return 0 <= min_x and max_x <= bed_size[0] and 0 <= min_y and max_y <= bed_size[1]
+
+def describe_summary(summary):
+    if summary['bounds'] is None:
+        bounds = "no XY moves"
+    else:
+        min_x, min_y, max_x, max_y = summary['bounds']
+        bounds = f"X {min_x:.1f}..{max_x:.1f}, Y {min_y:.1f}..{max_y:.1f}"
+    return (f"{bounds}, {summary['moves']} moves ({summary['extrusions']} extruding), "
+            f"{summary['layers']} layers, {summary['tool_changes']} tool changes")
+
+def summary_path(output_file_path):
+    return output_file_path + '.summary.json'
+
+def write_summary(output_file_path, summary):
+    with open(summary_path(output_file_path), 'w') as file:
+        json.dump(summary, file, indent=1)
+
+def parse_bed_size(text):
+    # "220x220" -> (220.0, 220.0)
+    try:
+        width, height = (float(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Invalid bed size: {text}. It should be in the format 'WIDTHxDEPTH', e.g. 220x220")
+    return width, height
+
+def read_line_chunks(file, chunk_size=TRANSLATE_BUFFER_SIZE):
+    # Yield blocks of bytes that always end on a line boundary
+    remainder = b''
+    while True:
+        block = file.read(chunk_size)
+        if not block:
+            break
+        block = remainder + block
+        cut = block.rfind(b'\n') + 1
+        if cut == 0:
+            remainder = block
+            continue
+        remainder = block[cut:]
+        yield block[:cut]
+    if remainder:
+        yield remainder
+
+def _translate_chunk_fast(chunk, x_offset, y_offset, stats=None):
+    # All X/Y values of the chunk are located, parsed, shifted and formatted
+    # as whole arrays, then spliced back between the untouched bytes. stats
+    # is given the parsed chunk and its shifted values.
+    from move_fields import MoveFields
+    fields = MoveFields(chunk)
+    shifted = fields.shifted(x_offset, y_offset)
+    if stats is not None:
+        stats.add(fields, shifted)
+    if not len(fields):
+        return chunk
+    return fields.replace(shifted)
+
+def _translate_gcode_legacy(input_file_path, output_file_path, x_offset, y_offset, stats=None):
+    # Returns the number of lines translated
+    line_count = 0
+    with open_gcode(input_file_path, 'r', buffering=TRANSLATE_BUFFER_SIZE) as infile, \
+            open_gcode(output_file_path, 'w', buffering=TRANSLATE_BUFFER_SIZE) as outfile:
+        # Add a comment with the offset information at the beginning of the file
+        outfile.write(f"; Translated with offsets: X={x_offset}mm, Y={y_offset}mm\n")
+
+        # Stream the input in batches of lines so memory stays bounded no matter
+        # how large the file is
+        while True:
+            lines = infile.readlines(TRANSLATE_BUFFER_SIZE)
+            if not lines:
+                break
+            line_count += len(lines)
+            text = _translate_lines(lines, x_offset, y_offset)
+            outfile.write(text)
+            if stats is not None:
+                stats.feed(text)
+    return line_count
+
+def iter_translated_chunks(input_file_path, x_offset, y_offset, engine='legacy', stats=None):
+    # Yield the translated file as byte chunks without writing it anywhere,
+    # collecting stats of the output when given
+    if engine not in TRANSLATE_ENGINES:
+        raise ValueError(f"Unknown translation engine: {engine}. Expected one of {', '.join(TRANSLATE_ENGINES)}")
+    
+    yield from _iter_translated_chunks(input_file_path, x_offset, y_offset, engine, stats)
+    if stats is not None:
+        stats.finish()
+
+def _iter_translated_chunks(input_file_path, x_offset, y_offset, engine, stats):
+    yield f"; Translated with offsets: X={x_offset}mm, Y={y_offset}mm\n".encode()
+    if engine == 'fast':
+        with open_gcode(input_file_path, 'rb') as infile:
+            for chunk in read_line_chunks(infile):
+                yield _translate_chunk_fast(chunk, x_offset, y_offset, stats)
+    else:
+        with open_gcode(input_file_path, 'r', buffering=TRANSLATE_BUFFER_SIZE) as infile:
+            while True:
+                lines = infile.readlines(TRANSLATE_BUFFER_SIZE)
+                if not lines:
+                    break
+                text = _translate_lines(lines, x_offset, y_offset).encode()
+                if stats is not None:
+                    stats.feed(text)
+                yield text
+
+def _translate_gcode_fast(input_file_path, output_file_path, x_offset, y_offset, stats=None):
+    # Returns the number of lines translated, not counting the header
+    line_count = -1
+    with open_gcode(output_file_path, 'wb', buffering=TRANSLATE_BUFFER_SIZE) as outfile:
+        for chunk in iter_translated_chunks(input_file_path, x_offset, y_offset, 'fast', stats):
+            outfile.write(chunk)
+            line_count += chunk.count(b'\n')
+    return line_count
+
+def _split_line_ranges(input_file_path, range_size=PARALLEL_RANGE_SIZE):
+    # Cut the file into (start, end) byte ranges that each end on a line boundary
+    ranges = []
+    file_size = os.path.getsize(input_file_path)
+    with open(input_file_path, 'rb') as file:
+        start = 0
+        while start < file_size:
+            file.seek(min(start + range_size, file_size))
+            file.readline()
+            end = file.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def _translate_range(input_file_path, start, end, x_offset, y_offset, engine, analyze=False):
+    # Returns the translated range, and its TranslationStats when analyze is set
+    with open(input_file_path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    stats = TranslationStats() if analyze else None
+    if engine == 'fast':
+        result = b''.join(_translate_chunk_fast(chunk, x_offset, y_offset, stats) for chunk in read_line_chunks(io.BytesIO(data)))
+    else:
+        # Decode with the same defaults as the text-mode open() of the serial path
+        with io.TextIOWrapper(io.BytesIO(data)) as text:
+            result = _translate_lines(text.readlines(), x_offset, y_offset)
+        if analyze:
+            stats.feed(result)
+    if not analyze:
+        return result
+    return result, stats.finish()
+
+def _translate_gcode_parallel(input_file_path, output_file_path, x_offset, y_offset, engine, workers, stats=None, mp_context=None):
+    header = f"; Translated with offsets: X={x_offset}mm, Y={y_offset}mm\n"
+    text_mode = engine == 'legacy'
+    analyze = stats is not None
+    line_count = 0
+    
+    def write(result):
+        # Each range is analyzed on its worker, the stats are merged in file order
+        nonlocal line_count
+        if analyze:
+            result, range_stats = result
+            stats.merge(range_stats)
+        outfile.write(result)
+        line_count += result.count('\n' if text_mode else b'\n')
+    
+    with open_gcode(output_file_path, 'w' if text_mode else 'wb', buffering=TRANSLATE_BUFFER_SIZE) as outfile, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+        outfile.write(header if text_mode else header.encode())
+        
+        # Keep a bounded window of ranges in flight and write them back in file order
+        pending = collections.deque()
+        for start, end in _split_line_ranges(input_file_path):
+            pending.append(pool.submit(_translate_range, input_file_path, start, end, x_offset, y_offset, engine, analyze))
+            if len(pending) >= 2 * workers:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+    return line_count
+
+def translate_gcode(input_file_path, output_file_path, x_offset, y_offset, engine='legacy', workers=1, analyze=False,
+                    mp_context=None):
+    # With analyze set, the translated output is also scanned as it is written
+    # and its summary (see TranslationStats.summary) is returned. Either file
+    # can be compressed (see gcode_files); a compressed input cannot be split
+    # into ranges and is always translated on one process. mp_context is the
+    # multiprocessing context the range workers are started with when workers
+    # is above 1, the platform default when None.
+    if engine not in TRANSLATE_ENGINES:
+        raise ValueError(f"Unknown translation engine: {engine}. Expected one of {', '.join(TRANSLATE_ENGINES)}")
+    
+    print(f"Translating GCode with offsets: X={x_offset}, Y={y_offset}")
+    stats = TranslationStats() if analyze else None
+    file_name = os.path.basename(input_file_path)
+    size = os.path.getsize(input_file_path)
+    with metrics.stage('translate', file=file_name, engine=engine, workers=workers) as stage, \
+            metrics.profiled(f"translate-{file_name}"):
+        if workers > 1 and size >= PARALLEL_MIN_SIZE and compression_of(input_file_path) is None:
+            stage['lines'] = _translate_gcode_parallel(input_file_path, output_file_path, x_offset, y_offset, engine, workers, stats,
+                                                       mp_context)
+        elif engine == 'fast':
+            stage['lines'] = _translate_gcode_fast(input_file_path, output_file_path, x_offset, y_offset, stats)
+        else:
+            stage['lines'] = _translate_gcode_legacy(input_file_path, output_file_path, x_offset, y_offset, stats)
+        stage['bytes'] = size
+        summary = stats.finish().summary() if stats is not None else None
+    return summary
+
+def translate_in_worker(profile_directory, *args):
+    # Run translate_gcode on a pool process and return its result with the
+    # metrics it recorded, which the parent process replays
+    metrics.recorder.profile_directory = profile_directory
+    with metrics.recorder.capture() as records:
+        summary = translate_gcode(*args)
+    return summary, records
@@ -0,0 +1,231 @@
+import json
+import logging
+import math
+import os
+import re
+
+import numpy as np
+
+from gcode_moves import move_points, move_bounds
+from gcode_translate import read_line_chunks, TRANSLATE_BUFFER_SIZE
+from gcode_files import LAYER_INDEX_SUFFIX
+from move_fields import MoveFields
+
+# Bump when the layout of the index file changes so old sidecars are rebuilt
+INDEX_VERSION = 2
+
+# A tool change line, anchored on the newline before it
+_TOOL_CHANGE_RE = re.compile(rb'\nT(\d+)(?![0-9.])')
+
+def index_path(file_path):
+    return file_path + LAYER_INDEX_SUFFIX
+
+def _new_layer(offset, z, tool, start_point):
+    return {
+        'z': z,
+        'offset': offset,
+        'end': offset,
+        'moves': 0,
+        'bounds': None,
+        'tool': tool,
+        'start_point': list(start_point),
+    }
+
+def _add_bounds(layer, moves, bounds):
+    layer['moves'] += moves
+    min_x, min_y, max_x, max_y = bounds
+    if layer['bounds'] is not None:
+        old_min_x, old_min_y, old_max_x, old_max_y = layer['bounds']
+        min_x, min_y = min(min_x, old_min_x), min(min_y, old_min_y)
+        max_x, max_y = max(max_x, old_max_x), max(max_y, old_max_y)
+    layer['bounds'] = [min_x, min_y, max_x, max_y]
+
+def _add_moves(layer, points):
+    if len(points):
+        _add_bounds(layer, len(points), move_bounds(points))
+
+def _fold(layer, candidate):
+    # Give the moves of a candidate layer that did not become one to the layer
+    # it was made in
+    if candidate['moves']:
+        _add_bounds(layer, candidate['moves'], candidate['bounds'])
+
+def _chunk_events(fields):
+    # The lines of a MoveFields block that matter for the index, as (offset
+    # in the block, kind, value) in file order: every move to a new Z height,
+    # the first extruding move after each of them (and after the start of the
+    # block), and every tool change
+    offsets = fields.lines - 1
+    heights = fields.words('Z')
+    z_lines = np.flatnonzero(~np.isnan(heights))
+    extruding = np.flatnonzero(fields.extruding())
+    events = [(offset, 'z', height) for offset, height in zip(offsets[z_lines].tolist(), heights[z_lines].tolist())]
+    if len(extruding):
+        after = np.searchsorted(extruding, np.append(z_lines, -1))
+        first = np.unique(extruding[after[after < len(extruding)]])
+        events += [(offset, 'extrude', None) for offset in offsets[first].tolist()]
+    events += [(match.start(), 'tool', int(match.group(1))) for match in _TOOL_CHANGE_RE.finditer(b'\n' + fields.chunk)]
+    # A Z move comes before the extruding move when they are the same line
+    return sorted(events, key=lambda event: (event[0], event[1] != 'z'))
+
+def build_layer_index(file_path, chunk_size=TRANSLATE_BUFFER_SIZE, cancelled=None):
+    # Read file_path once and record where every layer starts and ends, how
+    # many XY moves it has and their bounds, plus the offset of every tool
+    # change. A layer is started by the first extruding move (a G1 with X/Y
+    # and a positive E) at another height than the layer before, and begins
+    # at the Z move to that height. Until that extruding move comes, the Z
+    # move only starts a candidate layer: if the head goes back down (a Z hop)
+    # or moves to yet another height first, the moves made in between go back
+    # to the layer that is open. cancelled, when given, is called before every
+    # chunk; once it returns True the scan stops and None is returned.
+    stat = os.stat(file_path)
+    last_point = (0.0, 0.0)
+    tool = None
+    layers = [_new_layer(0, None, tool, last_point)]
+    candidate = None
+    pending_tool_changes = []  # Made while there is a candidate
+    tool_changes = []
+    z = math.nan
+    position = 0
+
+    def settle(promote):
+        # Make the candidate a layer, or give its moves back to the open one
+        nonlocal candidate
+        if promote:
+            layers[-1]['end'] = candidate['offset']
+            layers.append(candidate)
+        else:
+            _fold(layers[-1], candidate)
+        for tool_change in pending_tool_changes:
+            tool_change['layer'] = len(layers) - 1
+        tool_changes.extend(pending_tool_changes)
+        pending_tool_changes.clear()
+        candidate = None
+
+    with open(file_path, 'rb') as file:
+        for chunk in read_line_chunks(file, chunk_size):
+            if cancelled is not None and cancelled():
+                return None
+            fields = MoveFields(chunk)
+            points = move_points(fields, last_point)
+            move_starts = fields.lines[fields.move_lines] - 1  # Offset of each move's line in chunk
+            # Moves between two events belong to the candidate or open layer
+            first_move = 0
+            for line_start, kind, value in _chunk_events(fields):
+                if kind == 'z' and value == z:
+                    continue
+                if kind == 'tool' and value == tool:
+                    continue
+
+                end_move = int(np.searchsorted(move_starts, line_start))
+                _add_moves(candidate or layers[-1], points[first_move:end_move])
+                if end_move > first_move:
+                    last_point = tuple(points[end_move - 1].tolist())
+                first_move = end_move
+
+                if kind == 'z':
+                    z = value
+                    if candidate is not None:
+                        settle(promote=False)
+                    if z != layers[-1]['z']:
+                        candidate = _new_layer(position + line_start, z, tool, last_point)
+                elif kind == 'extrude':
+                    if candidate is not None:
+                        settle(promote=True)
+                else:
+                    tool = value
+                    tool_change = {'offset': position + line_start, 'tool': tool, 'layer': len(layers) - 1}
+                    (pending_tool_changes if candidate is not None else tool_changes).append(tool_change)
+
+            _add_moves(candidate or layers[-1], points[first_move:])
+            if len(points) > first_move:
+                last_point = tuple(points[-1].tolist())
+            position += len(chunk)
+    # A height nothing was extruded at, like the lift at the end, is no layer
+    if candidate is not None:
+        settle(promote=False)
+    layers[-1]['end'] = position
+
+    # Start-up code before the first layer only matters if it moves the head
+    if len(layers) > 1 and not layers[0]['moves']:
+        layers.pop(0)
+        for tool_change in tool_changes:
+            tool_change['layer'] = max(tool_change['layer'] - 1, 0)
+
+    return {
+        'version': INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'layers': layers,
+        'tool_changes': tool_changes,
+    }
+
+def save_layer_index(file_path, index):
+    path = index_path(file_path)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(index, file)
+    os.replace(temp_path, path)
+
+def read_layer_index(file_path):
+    # Return the saved index of file_path, or None when it is missing or no
+    # longer matches the file
+    try:
+        with open(index_path(file_path), 'r') as file:
+            index = json.load(file)
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable layer index for {file_path}: {e}")
+        return None
+    if index.get('version') != INDEX_VERSION or index.get('size') != stat.st_size \
+            or index.get('mtime_ns') != stat.st_mtime_ns:
+        return None
+    return index
+
+def load_layer_index(file_path, cancelled=None):
+    # Return the index of file_path, building and saving it next to the file
+    # when there is no up-to-date one yet. Returns None when the build was
+    # cancelled, see build_layer_index.
+    index = read_layer_index(file_path)
+    if index is None:
+        index = build_layer_index(file_path, cancelled=cancelled)
+        if index is None:
+            return None
+        try:
+            save_layer_index(file_path, index)
+        except OSError as e:
+            logging.warning(f"Could not save layer index for {file_path}: {e}")
+    return index
+
+def parse_layer_selection(text, layer_count):
+    # Turn a selection such as "3" or "1-5,10" (1-based, inclusive) into a
+    # sorted list of layer numbers. An empty selection means every layer.
+    text = text.strip()
+    if not text:
+        return list(range(layer_count))
+    selected = set()
+    for part in text.split(','):
+        first, dash, last = part.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if dash else first
+        except ValueError:
+            raise ValueError(f"Invalid layer selection: {part.strip()!r}")
+        if not 1 <= first <= last <= layer_count:
+            raise ValueError(f"Layers {part.strip()} are outside 1-{layer_count}")
+        selected.update(range(first - 1, last))
+    return sorted(selected)
+
+def layer_ranges(index, layer_numbers):
+    # (start, end, start_point) byte ranges covering the given layers, with
+    # neighbouring layers merged so they are read in one go
+    ranges = []
+    for number in sorted(layer_numbers):
+        layer = index['layers'][number]
+        if ranges and ranges[-1][1] == layer['offset']:
+            ranges[-1] = (ranges[-1][0], layer['end'], ranges[-1][2])
+        else:
+            ranges.append((layer['offset'], layer['end'], tuple(layer['start_point'])))
+    return ranges
@@ -2,13 +2,18 @@ import configparser
 import os
 import asyncio
 import logging
-from moonraker_api import MoonrakerClient, MoonrakerListener
-from aiohttp.client_exceptions import ClientConnectorError
 import urllib.parse
 import datetime
-import aiohttp
 import re
 import time
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from watcher import watch_directory
+from translation_cache import TranslationCache
+from gcode_translate import (TRANSLATE_BUFFER_SIZE, TranslationStats, translate_gcode, iter_translated_chunks, translate_in_worker,
+                             summary_fits_bed, describe_summary, write_summary, parse_bed_size)
+from gcode_files import open_gcode, compression_of, strip_compression, compression_suffix, parse_compression, is_gcode_file, gcode_size, move_gcode_file
+import metrics
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,92 +27,366 @@ def create_default_config(config_file_path):
     config['Moonraker'] = {
         'url': 'http://localhost:7125',
         'auto_upload': 'true',
-        'auto_start_print': 'false'
+        'auto_start_print': 'false',
+        'stream_upload': 'false',
+        'upload_concurrency': '2',
+        'upload_retries': '3',
+        'printers': 'all'
     }
+    # Optional printer farm, one "name = url" line per printer. When empty the
+    # single printer at [Moonraker] url is used.
+    config['Printers'] = {}
     config['Script'] = {
         'include_timestamp': 'false',
         'autowatch': 'false',
-        'watch_interval': '60'
+        'watch_interval': '60',
+        'watch_backend': 'auto',
+        'settle_time': '1.0',
+        'translate_engine': 'legacy',
+        'workers': '1',
+        'translate_workers': '1',
+        'keep_fixed_copy': 'true',
+        'fixed_compression': 'none',
+        'bed_check': 'true',
+        'bed_size': '220x220'
+    }
+    config['Cache'] = {
+        'enabled': 'false',
+        'directory': 'translation_cache',
+        'max_size_mb': '2048'
+    }
+    config['Metrics'] = {
+        'enabled': 'false',
+        'jsonl_path': 'metrics.jsonl',
+        'prometheus_path': 'metrics.prom',
+        'profile_translate': 'false',
+        'profile_directory': 'profiles'
+    }
+    config['Service'] = {
+        'host': '127.0.0.1',
+        'port': '8765',
+        'workers': '2',
+        'queue_size': '8',
+        'spool_directory': ''
     }
     with open(config_file_path, 'w') as configfile:
         config.write(configfile)
     print(f"Created default config file at {config_file_path}")
 
-def translate_gcode(input_file_path, output_file_path, x_offset, y_offset):
-    print(f"Translating GCode with offsets: X={x_offset}, Y={y_offset}")
-    with open(input_file_path, 'r') as file:
-        lines = file.readlines()
+# Upload tuning defaults: concurrent uploads per printer, attempts per upload
+# and the base delay of the exponential backoff between attempts
+UPLOAD_CONCURRENCY = 2
+UPLOAD_RETRIES = 3
+UPLOAD_BACKOFF = 1.0
+UPLOAD_RETRY_STATUSES = (429, 500, 502, 503, 504)
 
-    with open(output_file_path, 'w') as file:
-        # Add a comment with the offset information at the beginning of the file
-        file.write(f"; Translated with offsets: X={x_offset}mm, Y={y_offset}mm\n")
-        
-        for line in lines:
-            if line.startswith(('G0', 'G1')):  # Check for movement commands
-                parts = line.split()
-                new_parts = []
-                for part in parts:
-                    if part.startswith('X'):
-                        x_value = float(part[1:])
-                        new_x_value = x_value + x_offset  # Add the offset instead of subtracting
-                        new_parts.append(f'X{new_x_value:.3f}')
-                    elif part.startswith('Y'):
-                        y_value = float(part[1:])
-                        new_y_value = y_value + y_offset  # Add the offset instead of subtracting
-                        new_parts.append(f'Y{new_y_value:.3f}')
-                    else:
-                        new_parts.append(part)
-                new_line = ' '.join(new_parts)
-                file.write(new_line + '\n')
-            else:
-                file.write(line)
+# Seconds to wait for a printer to accept a connection, so an offline printer
+# in a farm fails fast instead of holding up the batch
+PRINTER_CONNECT_TIMEOUT = 10
+
+# Seconds between attempts to reach printers that went offline, in autowatch mode
+PRINTER_RECONNECT_INTERVAL = 30
+
+# The network stack (aiohttp, moonraker_api) is imported by the functions that
+# use it, so runs without uploads and the GUI start without loading it
+
+def _create_listener():
+    from moonraker_api import MoonrakerListener
+
+    class MyMoonrakerListener(MoonrakerListener):
+        async def state_changed(self, state: str) -> None:
+            logging.info(f"Moonraker connection state changed to: {state}")
+
+    return MyMoonrakerListener()
+
+def _create_http_session(upload_concurrency):
+    import aiohttp
+    # One keep-alive pool per printer, with room for the websocket next to the uploads
+    connector = aiohttp.TCPConnector(limit=upload_concurrency + 1, keepalive_timeout=60)
+    # aiohttp's default five minute limit per request, failing fast on connect
+    timeout = aiohttp.ClientTimeout(total=5 * 60, sock_connect=PRINTER_CONNECT_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+def _attach_upload_pool(client, session, upload_concurrency=UPLOAD_CONCURRENCY, upload_retries=UPLOAD_RETRIES):
+    client.session = session
+    client._upload_semaphore = asyncio.Semaphore(upload_concurrency)
+    client._upload_retries = upload_retries
 
-class MyMoonrakerListener(MoonrakerListener):
-    async def state_changed(self, state: str) -> None:
-        logging.info(f"Moonraker connection state changed to: {state}")
+async def connect_to_printer(url, upload_concurrency=UPLOAD_CONCURRENCY, upload_retries=UPLOAD_RETRIES):
+    with metrics.stage('connect', printer=url) as stage:
+        client = await _connect_to_printer(url, upload_concurrency, upload_retries)
+        stage['ok'] = client is not None
+        return client
 
-async def connect_to_printer(url):
+async def _connect_to_printer(url, upload_concurrency, upload_retries):
+    from moonraker_api import MoonrakerClient
+    from aiohttp.client_exceptions import ClientConnectorError
+    session = None
     try:
         parsed_url = urllib.parse.urlparse(url)
         host = parsed_url.hostname
         port = parsed_url.port or 7125  # Default to 7125 if no port is specified
         base_url = f"{parsed_url.scheme}://{host}:{port}"
         logging.info(f"Attempting to connect to Moonraker at {base_url}")
-        client = MoonrakerClient(MyMoonrakerListener(), host, port)
+        # The websocket client and every upload share one pooled HTTP session
+        session = _create_http_session(upload_concurrency)
+        client = MoonrakerClient(_create_listener(), host, port, session=session)
         await client.connect()
         client._base_url = base_url  # Store the base URL in the client object
+        _attach_upload_pool(client, session, upload_concurrency, upload_retries)
         return client
     except ClientConnectorError as e:
         logging.error(f"Failed to connect to Moonraker at {url}. Error: {e}")
-        return None
     except Exception as e:
         logging.error(f"Unexpected error while connecting to Moonraker: {e}")
-        return None
+    if session:
+        await session.close()
+    return None
 
-async def upload_file(client, file_path):
-    original_file_name = os.path.basename(file_path)
-    
-    # Create a URL-friendly filename
-    url_friendly_name = re.sub(r'[^\w\-_\.]', '_', original_file_name)
-    url_friendly_name = url_friendly_name.replace(' ', '_')
+async def disconnect_from_printer(client):
+    await client.disconnect()
+    session = getattr(client, 'session', None)
+    if session:
+        await session.close()
+
+def read_printers(config):
+    # Printers to send files to, as name -> url. [Printers] lists a farm with
+    # one "name = url" line per printer, otherwise the single [Moonraker] url is
+    # used. [Moonraker] printers picks a subset by name, "all" for every printer.
+    printers = dict(config.items('Printers')) if config.has_section('Printers') else {}
+    if not printers:
+        url = config.get('Moonraker', 'url')
+        return {urllib.parse.urlparse(url).hostname or url: url}
     
+    selection = config.get('Moonraker', 'printers', fallback='all').strip()
+    if selection.lower() in ('', 'all'):
+        return printers
+    names = [name.strip().lower() for name in selection.split(',') if name.strip()]
+    unknown = [name for name in names if name not in printers]
+    if unknown:
+        raise ValueError(f"Unknown printers in [Moonraker] printers: {', '.join(unknown)}. Expected names from [Printers]: {', '.join(printers)}")
+    return {name: printers[name] for name in names}
+
+async def _open_printer(name, url, upload_concurrency, upload_retries):
+    client = await connect_to_printer(url, upload_concurrency, upload_retries)
+    if client is None:
+        return None
+    try:
+        printer_info = await client.get_host_info()
+        logging.info(f"Connected to printer {name}: {printer_info['hostname']}")
+    except Exception as e:
+        logging.error(f"Failed to get host info from {name}: {e}")
+        await disconnect_from_printer(client)
+        return None
+    client._printer_name = name
+    return client
+
+async def connect_to_printers(printers, upload_concurrency=UPLOAD_CONCURRENCY, upload_retries=UPLOAD_RETRIES):
+    # Connect to all printers at once and return name -> client for the ones
+    # that answered. Each keeps its own pooled session open until
+    # disconnect_from_printers, and offline printers are left out.
+    clients = await asyncio.gather(*(_open_printer(name, url, upload_concurrency, upload_retries) for name, url in printers.items()))
+    return {name: client for name, client in zip(printers, clients) if client is not None}
+
+async def reconnect_printers(printers, clients, upload_concurrency=UPLOAD_CONCURRENCY, upload_retries=UPLOAD_RETRIES, interval=PRINTER_RECONNECT_INTERVAL):
+    # Runs in the background until cancelled: every interval seconds the
+    # printers missing from clients are tried again and the ones that answer
+    # are added back, so batches never wait for an offline printer
+    while True:
+        await asyncio.sleep(interval)
+        offline = {name: url for name, url in printers.items() if name not in clients}
+        if not offline:
+            continue
+        for name, client in (await connect_to_printers(offline, upload_concurrency, upload_retries)).items():
+            logging.info(f"Printer {name} is back online.")
+            clients[name] = client
+
+async def disconnect_from_printers(clients):
+    await asyncio.gather(*(disconnect_from_printer(client) for client in clients.values()), return_exceptions=True)
+
+def printer_file_name(file_name):
+    # The name a file is stored under on the printer
+    url_friendly_name = re.sub(r'[^\w\-_\.]', '_', file_name)
+    return url_friendly_name.replace(' ', '_')
+
+async def _post_upload(client, open_payload, original_file_name, url_friendly_name):
+    # open_payload() returns a fresh (payload, bytes_sent) pair for every attempt,
+    # where bytes_sent() reports how many bytes of the payload went out
     url = f"{client._base_url}/server/files/upload"
     
-    with open(file_path, 'rb') as file:
+    if getattr(client, '_upload_semaphore', None) is None:
+        _attach_upload_pool(client, getattr(client, 'session', None) or _create_http_session(UPLOAD_CONCURRENCY))
+    retries = getattr(client, '_upload_retries', UPLOAD_RETRIES)
+    
+    async with client._upload_semaphore:
+        # Waiting for a free slot is not part of the upload stage
+        with metrics.stage('upload', file=url_friendly_name, printer=client._base_url) as stage:
+            uploaded = await _send_upload(client, url, open_payload, original_file_name, url_friendly_name, retries, stage)
+            stage['ok'] = uploaded
+            return uploaded
+
+async def _send_upload(client, url, open_payload, original_file_name, url_friendly_name, retries, stage):
+    # The retry loop of _post_upload, filling in the upload stage's bytes and attempts
+    import aiohttp
+    for attempt in range(1, retries + 1):
+        stage['attempts'] = attempt
+        payload, bytes_sent = open_payload()
         data = aiohttp.FormData()
-        data.add_field('file', file, filename=url_friendly_name)
+        data.add_field('file', payload, filename=url_friendly_name)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=data) as response:
+        start_time = time.perf_counter()
+        try:
+            async with client.session.post(url, data=data) as response:
                 if response.status == 201:
-                    logging.info(f"Uploaded {original_file_name} to printer as {url_friendly_name}")
-                else:
+                    elapsed = time.perf_counter() - start_time
+                    size = bytes_sent()
+                    stage['bytes'] = size
+                    logging.info(f"Uploaded {original_file_name} to printer as {url_friendly_name} "
+                                 f"({size / 1e6:.1f} MB in {elapsed:.2f}s, {size / 1e6 / max(elapsed, 1e-9):.1f} MB/s)")
+                    return True
+                response_text = await response.text()
+                if response.status not in UPLOAD_RETRY_STATUSES or attempt == retries:
                     logging.error(f"Failed to upload {original_file_name}. Status: {response.status}")
-                    response_text = await response.text()
                     logging.error(f"Response: {response_text}")
+                    return False
+                logging.warning(f"Upload of {original_file_name} failed with status {response.status} (attempt {attempt}/{retries})")
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == retries:
+                raise
+            logging.warning(f"Upload of {original_file_name} failed: {e} (attempt {attempt}/{retries})")
+        finally:
+            if hasattr(payload, 'close'):
+                payload.close()
+        
+        await asyncio.sleep(UPLOAD_BACKOFF * 2 ** (attempt - 1))
+
+async def _printer_has_file(client, file_name, size):
+    # Ask Moonraker for the metadata of an uploaded G-code file and compare sizes
+    import aiohttp
+    url = f"{client._base_url}/server/files/metadata"
+    session = getattr(client, 'session', None)
+    if session is None:
+        return False
+    try:
+        async with session.get(url, params={'filename': file_name}) as response:
+            if response.status != 200:
+                return False
+            metadata = await response.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return False
+    return metadata.get('result', {}).get('size') == size
+
+async def upload_file(client, file_path, progress=None):
+    # progress, when given, is called as progress(bytes_sent, total_bytes) while
+    # the file is sent. A compressed file is decompressed while it is sent and
+    # the printer gets it without the compression suffix; its size is not
+    # known up front, so progress is called as progress(bytes_sent, None).
+    original_file_name = os.path.basename(file_path)
+    
+    # Create a URL-friendly filename
+    url_friendly_name = printer_file_name(strip_compression(original_file_name))
+    
+    if compression_of(file_path):
+        def open_payload():
+            counter = [0]
+            report = (lambda sent: progress(sent, None)) if progress else None
+            return _iterate_in_thread(_read_file_chunks(file_path), counter, report), lambda: counter[0]
+        
+        return await _post_upload(client, open_payload, original_file_name, url_friendly_name)
+    
+    file_size = os.path.getsize(file_path)
+    if progress is None:
+        return await _post_upload(client, lambda: (open(file_path, 'rb'), lambda: file_size), original_file_name, url_friendly_name)
+    
+    def open_payload():
+        # Read the file ourselves so every chunk handed to aiohttp is counted
+        counter = [0]
+        chunks = _read_file_chunks(file_path)
+        return _iterate_in_thread(chunks, counter, lambda sent: progress(sent, file_size)), lambda: counter[0]
+    
+    return await _post_upload(client, open_payload, original_file_name, url_friendly_name)
+
+def _read_file_chunks(file_path, chunk_size=TRANSLATE_BUFFER_SIZE):
+    with open_gcode(file_path, 'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+async def _iterate_in_thread(iterator, counter=None, progress=None, running=None):
+    # Pull items from a blocking iterator on a worker thread so the event loop
+    # keeps running, adding the size of every item to counter[0] and reporting
+    # the running total to progress. The pull in progress is shielded from
+    # cancellation and kept in running[0], so the iterator can be waited for
+    # before anything else touches it.
+    loop = asyncio.get_running_loop()
+    done = object()
+    while True:
+        future = loop.run_in_executor(None, next, iterator, done)
+        if running is not None:
+            running[0] = future
+        item = await asyncio.shield(future)
+        if item is done:
+            break
+        if counter is not None:
+            counter[0] += len(item)
+            if progress is not None:
+                progress(counter[0])
+        yield item
+
+def _tee_to_file(chunks, file_path):
+    with open_gcode(file_path, 'wb', buffering=TRANSLATE_BUFFER_SIZE) as file:
+        for chunk in chunks:
+            file.write(chunk)
+            yield chunk
+
+async def upload_translated(client, input_file_path, output_file_path, x_offset, y_offset, engine='legacy', keep_copy=True, progress=None, stats=None):
+    # Translate and stream the result straight into the upload body. The printer
+    # receives the file under the basename of output_file_path, and the local
+    # copy is only written there when keep_copy is set. The translated size is
+    # not known up front, so progress is called as progress(bytes_sent, None).
+    # stats, when given, is filled in from the translated output that was sent.
+    # A compressed output_file_path is only compressed locally.
+    original_file_name = os.path.basename(output_file_path)
+    url_friendly_name = printer_file_name(strip_compression(original_file_name))
+    
+    # A retried upload translates the file again from the start
+    attempts = []
+    
+    def open_payload():
+        if stats is not None:
+            stats.reset()
+        chunks = iter_translated_chunks(input_file_path, x_offset, y_offset, engine, stats)
+        if keep_copy:
+            chunks = _tee_to_file(chunks, output_file_path)
+        counter = [0]
+        running = [None]
+        attempts.append((chunks, running))
+        report = (lambda sent: progress(sent, None)) if progress else None
+        return _iterate_in_thread(chunks, counter, report, running), lambda: counter[0]
+    
+    try:
+        return await _post_upload(client, open_payload, original_file_name, url_friendly_name)
+    finally:
+        # Shielded, so a cancelled upload still waits for the translation
+        # in progress and leaves a complete local copy before it ends
+        await asyncio.shield(asyncio.ensure_future(_finish_attempts(attempts, keep_copy)))
+
+async def _finish_attempts(attempts, keep_copy):
+    # Close the translations of upload_translated once no worker thread is in
+    # them any more, finishing the local copy of the last one first even if
+    # the printer stopped reading early
+    await asyncio.gather(*(running[0] for _, running in attempts if running[0] is not None), return_exceptions=True)
+    if keep_copy and attempts:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, collections.deque, attempts[-1][0], 0)
+    for chunks, _ in attempts:
+        chunks.close()
 
 async def start_print(client, file_name):
-    await client.call_method("printer.print.start", filename=file_name)
+    with metrics.stage('start_print', file=file_name, printer=getattr(client, '_base_url', None)):
+        await client.call_method("printer.print.start", filename=file_name)
     print(f"Started printing {file_name}")
 
 def validate_moonraker_url(url):
@@ -115,39 +394,214 @@ def validate_moonraker_url(url):
     if not all([parsed_url.scheme, parsed_url.hostname, parsed_url.port]):
         raise ValueError(f"Invalid Moonraker URL: {url}. It should be in the format 'http://hostname:port'")
 
-async def process_files(input_directory, output_directory, x_offset, y_offset, include_timestamp, client, auto_upload, auto_start_print):
-    for filename in os.listdir(input_directory):
-        if filename.endswith('.gcode'):
-            input_file_path = os.path.join(input_directory, filename)
-            base_name, ext = os.path.splitext(filename)
-            
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S") if include_timestamp else ""
-            timestamp_part = f"_{timestamp}" if timestamp else ""
-            
-            new_filename = f"{base_name.replace(' ', '_').replace('(', '').replace(')', '')}-FIXED_X{x_offset:.1f}_Y{y_offset:.1f}{timestamp_part}{ext}"
-            output_file_path = os.path.join(output_directory, new_filename)
-            
-            translate_gcode(input_file_path, output_file_path, x_offset, y_offset)
-            logging.info(f"Processed {filename} -> {new_filename}")
-            
-            if auto_upload and client:
-                try:
-                    await upload_file(client, output_file_path)
-                    
-                    if auto_start_print:
-                        logging.info(f"Auto-start print is enabled. Starting print of {new_filename}")
-                        await start_print(client, new_filename)
-                    else:
-                        logging.info("Auto-start print is disabled. Skipping print start.")
-                except Exception as e:
-                    logging.error(f"Failed to upload or start print: {e}")
+def fixed_file_name(filename, x_offset, y_offset, include_timestamp=False, compression=None):
+    # The output keeps the input's extension, compressed as given regardless
+    # of how the input was compressed
+    base_name, ext = os.path.splitext(strip_compression(filename))
+    
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S") if include_timestamp else ""
+    timestamp_part = f"_{timestamp}" if timestamp else ""
+    
+    return f"{base_name.replace(' ', '_').replace('(', '').replace(')', '')}-FIXED_X{x_offset:.1f}_Y{y_offset:.1f}{timestamp_part}{ext}{compression_suffix(compression)}"
+
+async def process_file(input_directory, output_directory, filename, x_offset, y_offset, include_timestamp, clients, auto_upload, auto_start_print, engine='legacy', executor=None, translate_workers=1, stream_upload=False, keep_fixed_copy=True, cache=None, bed_size=None, compression=None):
+    # With bed_size set, the translated file is analyzed while it is written
+    # and files that leave the bed are neither uploaded nor printed. clients maps
+    # printer names to connected clients; the file goes to all of them and the
+    # result of every printer is returned. compression is how the copy in
+    # output_directory is stored; the printers always get plain G-code.
+    clients = clients or {}
+    input_file_path = os.path.join(input_directory, filename)
+    new_filename = fixed_file_name(filename, x_offset, y_offset, include_timestamp, compression)
+    output_file_path = os.path.join(output_directory, new_filename)
+    
+    cache_key = None
+    cached = False
+    if cache:
+        # Hashing a large file is I/O bound, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        cache_key = await loop.run_in_executor(None, cache.make_key, input_file_path, x_offset, y_offset, engine, compression)
+        # With the bed check on, an entry stored without a summary is a miss
+        # so the file is translated and analyzed again
+        cached = cache.lookup(cache_key, output_file_path, need_summary=bed_size is not None)
+        if cached:
+            logging.info(f"Reused cached translation for {filename} -> {new_filename}")
+    
+    analyze = bed_size is not None
+    summary = cache.summary(cache_key) if cached else None
+    
+    # When streaming, translation happens while the upload body is being sent.
+    # Several printers share one translated file instead.
+    stream = stream_upload and auto_upload and len(clients) == 1 and not cached
+    if not stream and not cached:
+        if executor is None:
+            summary = translate_gcode(input_file_path, output_file_path, x_offset, y_offset, engine, translate_workers, analyze)
+        else:
+            # Translate in a worker process so the event loop stays free to upload other files
+            loop = asyncio.get_running_loop()
+            summary, records = await loop.run_in_executor(executor, translate_in_worker, metrics.recorder.profile_directory, input_file_path, output_file_path, x_offset, y_offset, engine, translate_workers, analyze)
+            metrics.recorder.replay(records)
+        logging.info(f"Processed {filename} -> {new_filename}")
+        if cache:
+            cache.store(cache_key, output_file_path, summary)
+    
+    fits_bed = _check_summary(new_filename, output_file_path, summary, bed_size)
+    results = []
+    if not fits_bed:
+        logging.error(f"Not uploading or printing {new_filename}.")
+    elif auto_upload and clients:
+        upload_name = printer_file_name(strip_compression(new_filename))
+        stats = TranslationStats() if stream and analyze else None
+        
+        async def upload(client):
+            nonlocal summary, fits_bed
+            if cached and cache.was_uploaded(cache_key, client._base_url, upload_name) \
+                    and await _printer_has_file(client, upload_name, await printed_size()):
+                logging.info(f"Printer already has an identical {upload_name}. Skipping upload.")
+                return True
+            if stream:
+                uploaded = await upload_translated(client, input_file_path, output_file_path, x_offset, y_offset, engine, keep_fixed_copy, stats=stats)
+                logging.info(f"Processed {filename} -> {new_filename} (streamed to printer)")
+                # A streamed file can only be checked once it was sent,
+                # so leaving the bed only stops the print from starting. The
+                # local copy is finished even when the upload failed, and so
+                # are the stats of it.
+                summary = stats.summary() if analyze and (uploaded or keep_fixed_copy) else None
+                if cache and keep_fixed_copy:
+                    cache.store(cache_key, output_file_path, summary)
+                fits_bed = _check_summary(new_filename, output_file_path if keep_fixed_copy else None, summary, bed_size)
             else:
-                logging.info(f"Auto-upload is disabled. Skipping upload of {new_filename}")
-            
-            # Move the processed file to a 'processed' subdirectory
-            processed_dir = os.path.join(input_directory, 'processed')
-            os.makedirs(processed_dir, exist_ok=True)
-            os.rename(input_file_path, os.path.join(processed_dir, filename))
+                uploaded = await upload_file(client, output_file_path)
+            if uploaded and cache:
+                cache.record_upload(cache_key, client._base_url, upload_name)
+            return uploaded
+        
+        async def print_file(client):
+            await start_print(client, upload_name)
+            return True
+        
+        size_future = []
+        
+        async def printed_size():
+            # Size of the file as the printer stores it, read through once for
+            # a compressed copy and shared by all printers
+            if not size_future:
+                loop = asyncio.get_running_loop()
+                size_future.append(loop.run_in_executor(None, gcode_size, output_file_path))
+            return await size_future[0]
+        
+        async def deliver(result, client):
+            # Each printer starts its print as soon as its own upload is done
+            await _run_on_printer(result, client, 'uploaded', upload)
+            if result['uploaded'] and fits_bed and auto_start_print:
+                await _run_on_printer(result, client, 'print_started', print_file)
+        
+        if auto_start_print:
+            logging.info(f"Auto-start print is enabled. Starting print of {new_filename} once uploaded")
+        else:
+            logging.info("Auto-start print is disabled. Skipping print start.")
+        
+        # Every printer is sent the file at the same time over its own pooled
+        # connection, so a slow or offline printer does not hold up the others
+        targets = list(clients.items())
+        results = [{'printer': name, 'uploaded': False, 'print_started': False, 'seconds': 0.0, 'error': None, 'offline': False} for name, _ in targets]
+        await asyncio.gather(*(deliver(result, client) for result, (_, client) in zip(results, targets)))
+        if not fits_bed:
+            logging.error(f"Not starting a print of {new_filename}.")
+        _log_printer_results(new_filename, results)
+        
+        # Printers that could not be reached are left out of the following
+        # files instead of making each of them wait for the retries again
+        for result, (name, client) in zip(results, targets):
+            if result['offline'] and clients.get(name) is client:
+                logging.warning(f"Leaving {name} out until it can be reached again.")
+                del clients[name]
+                await disconnect_from_printers({name: client})
+    elif auto_upload:
+        logging.warning(f"No printer is online. Not uploading {new_filename}, it is kept in {output_directory}")
+    else:
+        logging.info(f"Auto-upload is disabled. Skipping upload of {new_filename}")
+    
+    # Move the processed file, with the sidecars the viewer saved next to
+    # it, to a 'processed' subdirectory
+    processed_dir = os.path.join(input_directory, 'processed')
+    os.makedirs(processed_dir, exist_ok=True)
+    move_gcode_file(input_file_path, os.path.join(processed_dir, filename))
+    return results
+
+async def _run_on_printer(result, client, key, action):
+    # One printer's part of a fan-out: store whether action(client) succeeded
+    # in result[key] and add the time it took. A failure is kept in the result
+    # instead of stopping the other printers.
+    import aiohttp
+    start_time = time.perf_counter()
+    try:
+        result[key] = bool(await action(client))
+    except Exception as e:
+        result['error'] = str(e) or type(e).__name__
+        result['offline'] = isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+        logging.error(f"Failed to upload or start print on {result['printer']}: {e}")
+    finally:
+        result['seconds'] += time.perf_counter() - start_time
+
+def _log_printer_results(new_filename, results):
+    for result in results:
+        if result['error']:
+            outcome = f"failed ({result['error']})"
+        elif result['print_started']:
+            outcome = "uploaded and printing"
+        elif result['uploaded']:
+            outcome = "uploaded"
+        else:
+            outcome = "not uploaded"
+        logging.info(f"{new_filename} on {result['printer']}: {outcome} after {result['seconds']:.2f}s")
+
+def _check_summary(new_filename, output_file_path, summary, bed_size):
+    # Log and save the summary of a translated file and return whether it stays
+    # on the bed. Files without a summary (no analysis) pass.
+    if summary is None:
+        return True
+    logging.info(f"{new_filename}: {describe_summary(summary)}")
+    if output_file_path:
+        write_summary(output_file_path, summary)
+    if bed_size is not None and not summary_fits_bed(summary, bed_size):
+        logging.error(f"{new_filename} goes off the {bed_size[0]:g}x{bed_size[1]:g} mm bed")
+        return False
+    return True
+
+async def process_files(input_directory, output_directory, x_offset, y_offset, include_timestamp, clients, auto_upload, auto_start_print, engine='legacy', executor=None, translate_workers=1, stream_upload=False, keep_fixed_copy=True, filenames=None, cache=None, bed_size=None, compression=None):
+    if filenames is None:
+        filenames = [filename for filename in os.listdir(input_directory) if is_gcode_file(filename)]
+    if not filenames:
+        return
+    
+    with metrics.stage('process_files', files=len(filenames)):
+        if executor is None:
+            for filename in filenames:
+                await process_file(input_directory, output_directory, filename, x_offset, y_offset, include_timestamp, clients, auto_upload, auto_start_print, engine, translate_workers=translate_workers, stream_upload=stream_upload, keep_fixed_copy=keep_fixed_copy, cache=cache, bed_size=bed_size, compression=compression)
+        else:
+            # With a worker pool every file gets its own task: translations run on the
+            # pool's processes while finished files are already being uploaded
+            await asyncio.gather(*(
+                process_file(input_directory, output_directory, filename, x_offset, y_offset, include_timestamp, clients, auto_upload, auto_start_print, engine, executor, translate_workers, stream_upload, keep_fixed_copy, cache, bed_size, compression)
+                for filename in filenames
+            ))
+    metrics.recorder.write_prometheus()
+    
+    if cache:
+        logging.info(cache.report())
+
+def configure_metrics(config):
+    # Apply the [Metrics] section and return whether metrics are enabled
+    if not config.getboolean('Metrics', 'enabled', fallback=False):
+        return False
+    profile_translate = config.getboolean('Metrics', 'profile_translate', fallback=False)
+    metrics.configure(
+        config.get('Metrics', 'jsonl_path', fallback='metrics.jsonl'),
+        config.get('Metrics', 'prometheus_path', fallback='metrics.prom'),
+        config.get('Metrics', 'profile_directory', fallback='profiles') if profile_translate else None
+    )
+    return True
 
 async def main_async():
     config_file_path = 'config.ini'
@@ -161,53 +615,89 @@ async def main_async():
     x_offset = config.getfloat('Offsets', 'x_offset')
     y_offset = config.getfloat('Offsets', 'y_offset')
     
-    moonraker_url = config.get('Moonraker', 'url')
+    printers = read_printers(config)
     auto_upload = config.getboolean('Moonraker', 'auto_upload')
     auto_start_print = config.getboolean('Moonraker', 'auto_start_print')
+    stream_upload = config.getboolean('Moonraker', 'stream_upload', fallback=False)
+    upload_concurrency = config.getint('Moonraker', 'upload_concurrency', fallback=UPLOAD_CONCURRENCY)
+    upload_retries = config.getint('Moonraker', 'upload_retries', fallback=UPLOAD_RETRIES)
     
     include_timestamp = config.getboolean('Script', 'include_timestamp')
     autowatch = config.getboolean('Script', 'autowatch')
     watch_interval = config.getint('Script', 'watch_interval')
+    watch_backend = config.get('Script', 'watch_backend', fallback='auto')
+    settle_time = config.getfloat('Script', 'settle_time', fallback=1.0)
+    translate_engine = config.get('Script', 'translate_engine', fallback='legacy')
+    workers = config.getint('Script', 'workers', fallback=1)
+    translate_workers = config.getint('Script', 'translate_workers', fallback=1)
+    keep_fixed_copy = config.getboolean('Script', 'keep_fixed_copy', fallback=True)
+    fixed_compression = parse_compression(config.get('Script', 'fixed_compression', fallback='none'))
+    bed_check = config.getboolean('Script', 'bed_check', fallback=True)
+    bed_size = parse_bed_size(config.get('Script', 'bed_size', fallback='220x220')) if bed_check else None
     
+    cache_enabled = config.getboolean('Cache', 'enabled', fallback=False)
+    cache_directory = config.get('Cache', 'directory', fallback='translation_cache')
+    cache_max_size_mb = config.getfloat('Cache', 'max_size_mb', fallback=2048)
+    
+    metrics_enabled = configure_metrics(config)
+    
+    logging.info(f"Printers are set to: {', '.join(printers)}")
     logging.info(f"Auto-upload is set to: {auto_upload}")
     logging.info(f"Auto-start print is set to: {auto_start_print}")
+    logging.info(f"Stream upload is set to: {stream_upload}")
+    logging.info(f"Upload concurrency is set to: {upload_concurrency}")
     logging.info(f"Include timestamp is set to: {include_timestamp}")
     logging.info(f"Autowatch is set to: {autowatch}")
+    logging.info(f"Watch backend is set to: {watch_backend}")
+    logging.info(f"Translate engine is set to: {translate_engine}")
+    logging.info(f"Workers is set to: {workers}")
+    logging.info(f"Translate workers is set to: {translate_workers}")
+    logging.info(f"Keep fixed copy is set to: {keep_fixed_copy}")
+    logging.info(f"Fixed compression is set to: {fixed_compression or 'none'}")
+    logging.info(f"Bed check is set to: {f'{bed_size[0]:g}x{bed_size[1]:g}' if bed_check else False}")
+    logging.info(f"Translation cache is set to: {cache_enabled}")
+    logging.info(f"Metrics is set to: {metrics_enabled}")
 
     input_directory = 'fixme'
     output_directory = 'fixed'
     
     os.makedirs(output_directory, exist_ok=True)
     
-    client = None
+    clients = {}
     if auto_upload or auto_start_print:
-        client = await connect_to_printer(moonraker_url)
-        if client is None:
-            logging.warning("Failed to connect to Moonraker. Continuing without upload/print functionality.")
-            auto_upload = False
-            auto_start_print = False
-        else:
-            try:
-                printer_info = await client.get_host_info()
-                logging.info(f"Connected to printer: {printer_info['hostname']}")
-            except Exception as e:
-                logging.error(f"Failed to get host info: {e}")
-                await client.disconnect()
-                client = None
-                auto_upload = False
-                auto_start_print = False
+        clients = await connect_to_printers(printers, upload_concurrency, upload_retries)
+        if not clients:
+            if autowatch:
+                logging.warning(f"Failed to connect to Moonraker. Files are not uploaded until a printer answers, trying again every {PRINTER_RECONNECT_INTERVAL:g} seconds.")
+            else:
+                logging.warning("Failed to connect to Moonraker. Continuing without upload/print functionality.")
+        elif len(clients) < len(printers):
+            offline = [name for name in printers if name not in clients]
+            logging.warning(f"Could not connect to {', '.join(offline)}. Continuing with {', '.join(clients)}.")
     
-    while True:
-        await process_files(input_directory, output_directory, x_offset, y_offset, include_timestamp, client, auto_upload, auto_start_print)
-        
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    cache = TranslationCache(cache_directory, int(cache_max_size_mb * 1024 * 1024)) if cache_enabled else None
+    
+    reconnect_task = None
+    try:
         if not autowatch:
-            break
-        
-        logging.info(f"Waiting {watch_interval} seconds before checking for new files...")
-        await asyncio.sleep(watch_interval)
+            await process_files(input_directory, output_directory, x_offset, y_offset, include_timestamp, clients, auto_upload, auto_start_print, translate_engine, executor, translate_workers, stream_upload, keep_fixed_copy, cache=cache, bed_size=bed_size, compression=fixed_compression)
+        else:
+            if auto_upload or auto_start_print:
+                # Printers that are offline, even all of them, are tried again
+                # in the background and join the following files once they answer
+                reconnect_task = asyncio.create_task(reconnect_printers(printers, clients, upload_concurrency, upload_retries))
+            # Each batch only holds files that are completely written
+            async for filenames in watch_directory(input_directory, watch_interval, watch_backend, settle_time):
+                await process_files(input_directory, output_directory, x_offset, y_offset, include_timestamp, clients, auto_upload, auto_start_print, translate_engine, executor, translate_workers, stream_upload, keep_fixed_copy, filenames, cache, bed_size, fixed_compression)
+    finally:
+        if reconnect_task:
+            reconnect_task.cancel()
+            await asyncio.gather(reconnect_task, return_exceptions=True)
+        if executor:
+            executor.shutdown()
 
-    if client:
-        await client.disconnect()
+    await disconnect_from_printers(clients)
 
 def main():
     try:
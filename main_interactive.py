@@ -1,19 +1,245 @@
 import sys
 import os
 import configparser
-from PySide6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QFileDialog, QLabel, QLineEdit, QFormLayout, QMessageBox, QDialog, QComboBox, QTextEdit
-from PySide6.QtGui import QPainter, QColor, QPen, QFont, QTextCursor
-from PySide6.QtCore import Qt, QPointF, QRectF, Signal
+from PySide6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QFileDialog, QLabel, QLineEdit, QFormLayout, QMessageBox, QDialog, QComboBox, QTextEdit, QProgressBar
+from PySide6.QtGui import QPainter, QColor, QPen, QFont, QTextCursor, QPolygonF, QPixmap
+from PySide6.QtCore import Qt, QPointF, QRectF, Signal, QThread
 import datetime
-from main import translate_gcode, upload_file, connect_to_printer  # Import functions from main.py
+import math
+import multiprocessing
+import time
+from main import upload_file, connect_to_printer, disconnect_from_printer, start_print, printer_file_name  # Import functions from main.py
+from gcode_translate import translate_gcode, TRANSLATE_ENGINES, BED_SIZE, parse_bed_size, describe_summary, summary_fits_bed, write_summary
+from watcher import WATCH_BACKENDS
+from gcode_moves import load_moves, move_bounds, iter_move_chunks
+from layer_index import load_layer_index, parse_layer_selection, layer_ranges
+from offset_template import compile_template
+from segment_grid import SegmentGrid
+import numpy as np
+import shiboken6
 import asyncio
 
+# Largest toolpath pixmap kept between repaints (per side, in device pixels)
+# and the margin around the toolpath inside it
+MAX_CACHE_DIMENSION = 4096
+CACHE_PADDING = 2
+
+# Extra room (as a fraction of the toolpath size) given to the pixmap when the
+# toolpath outgrows it while loading
+CACHE_GROWTH = 0.1
+
+# Room (as a fraction of the visible area) on every side of a pixmap that only
+# covers the visible part of the toolpath, so short drags do not redraw it
+VIEWPORT_CACHE_MARGIN = 0.5
+
+# Seconds between partial toolpath updates while a file loads in the background
+LOAD_UPDATE_INTERVAL = 0.25
+
+# Seconds between upload progress updates
+UPLOAD_PROGRESS_INTERVAL = 0.1
+
+# Files up to this size are kept compiled in memory after the first fix, so
+# fixing again at another offset does not re-read and re-parse them
+MAX_TEMPLATE_FILE_SIZE = 512 * 1024 * 1024
+
+def points_to_polygon(points):
+    # Fill a QPolygonF through its buffer instead of creating one QPointF per move
+    polygon = QPolygonF()
+    polygon.resize(len(points))
+    if len(points):
+        buffer = shiboken6.VoidPtr(polygon.data(), len(points) * 2 * 8, True)
+        np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = points
+    return polygon
+
+def decimate_points(points, cell_size):
+    # Level of detail: drop consecutive points that land in the same cell of a
+    # cell_size grid, so zoomed-out views never draw sub-pixel segments
+    if len(points) < 3:
+        return points
+    cells = np.floor(points / cell_size).astype(np.int64)
+    keep = np.empty(len(points), dtype=bool)
+    keep[0] = True
+    np.any(cells[1:] != cells[:-1], axis=1, out=keep[1:])
+    keep[-1] = True
+    return points[keep]
+
+def join_points(arrays):
+    # One array from several, without copying a lone one (such as the memmap
+    # of a cached file)
+    if len(arrays) == 1:
+        return arrays[0]
+    if not arrays:
+        return np.empty((0, 2), dtype=np.float32)
+    return np.concatenate(arrays)
+
+class GCodeLoader(QThread):
+    # Parses a G-code file off the GUI thread and hands the moves over in
+    # batches, so the viewer can draw the toolpath while the file loads.
+    # With a layer selection only those layers are read, using the file's
+    # layer index to seek straight to them. Once every batch was sent, the
+    # spatial index for zoomed-in drawing is built here as well. Building
+    # either index stops early when the loader is interrupted.
+    moves_loaded = Signal(object, int, int)  # points, bytes read, bytes to read
+    loading_finished = Signal(int, object)  # total number of moves, SegmentGrid
+    loading_failed = Signal(str)
+
+    def __init__(self, filename, layers='', parent=None):
+        super().__init__(parent)
+        self.filename = filename
+        self.layers = layers
+
+    def run(self):
+        try:
+            ranges = None
+            if self.layers.strip():
+                index = load_layer_index(self.filename, cancelled=self.isInterruptionRequested)
+                if index is None:
+                    return
+                ranges = layer_ranges(index, parse_layer_selection(self.layers, len(index['layers'])))
+                total_size = sum(end - start for start, end, _ in ranges)
+            else:
+                total_size = os.path.getsize(self.filename)
+            pending = []
+            batches = []
+            move_count = 0
+            last_update = time.monotonic()
+            for points, bytes_read in iter_move_chunks(self.filename, ranges=ranges, cache=True):
+                if self.isInterruptionRequested():
+                    return
+                pending.append(points)
+                move_count += len(points)
+                if time.monotonic() - last_update >= LOAD_UPDATE_INTERVAL:
+                    batches.append(join_points(pending))
+                    self.moves_loaded.emit(batches[-1], bytes_read, total_size)
+                    pending = []
+                    last_update = time.monotonic()
+            if pending:
+                batches.append(join_points(pending))
+                self.moves_loaded.emit(batches[-1], total_size, total_size)
+            points = join_points(batches)
+            del batches
+            segment_grid = SegmentGrid(points, cancelled=self.isInterruptionRequested)
+            if self.isInterruptionRequested():
+                return
+            self.loading_finished.emit(move_count, segment_grid)
+        except (OSError, ValueError) as e:
+            self.loading_failed.emit(str(e))
+
+class UploadWorker(QThread):
+    # Runs an asyncio event loop on its own thread and works through queued
+    # uploads one at a time, so the GUI stays responsive while files are sent
+    upload_status = Signal(int, str)  # job id, message
+    upload_progress = Signal(int, object, object, float)  # job id, bytes sent, total bytes (None if unknown), MB/s
+    upload_finished = Signal(int, bool)  # job id, success
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.loop = asyncio.new_event_loop()
+        self._queue = asyncio.Queue()
+        self._cancelled = set()
+        self._current = None  # (job id, task) of the running upload
+        self._next_job_id = 1
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        consumer = self.loop.create_task(self._process_queue())
+        self.loop.run_forever()
+        consumer.cancel()
+        self.loop.run_until_complete(asyncio.gather(consumer, return_exceptions=True))
+        self.loop.close()
+
+    def enqueue(self, url, file_path, auto_start_print):
+        # Called from the GUI thread. Returns the id used in the signals.
+        job_id = self._next_job_id
+        self._next_job_id += 1
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, (job_id, url, file_path, auto_start_print))
+        return job_id
+
+    def cancel(self, job_id):
+        self.loop.call_soon_threadsafe(self._cancel, job_id)
+
+    def stop(self):
+        if self.isRunning():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.wait()
+
+    def _cancel(self, job_id):
+        self._cancelled.add(job_id)
+        if self._current and self._current[0] == job_id:
+            self._current[1].cancel()
+
+    async def _process_queue(self):
+        while True:
+            job_id, url, file_path, auto_start_print = await self._queue.get()
+            if job_id in self._cancelled:
+                self._cancelled.discard(job_id)
+                self.upload_status.emit(job_id, "Upload cancelled.")
+                self.upload_finished.emit(job_id, False)
+                continue
+            
+            task = asyncio.ensure_future(self._upload(job_id, url, file_path, auto_start_print))
+            self._current = (job_id, task)
+            try:
+                success = await task
+            except asyncio.CancelledError:
+                if job_id not in self._cancelled:
+                    raise  # The worker itself is shutting down
+                self.upload_status.emit(job_id, "Upload cancelled.")
+                success = False
+            except Exception as e:
+                self.upload_status.emit(job_id, f"Upload failed: {e}")
+                success = False
+            finally:
+                self._current = None
+                self._cancelled.discard(job_id)
+            self.upload_finished.emit(job_id, success)
+
+    async def _upload(self, job_id, url, file_path, auto_start_print):
+        self.upload_status.emit(job_id, f"Connecting to Mainsail at {url}...")
+        client = await connect_to_printer(url)
+        if not client:
+            self.upload_status.emit(job_id, "Failed to connect to Mainsail.")
+            return False
+        
+        try:
+            self.upload_status.emit(job_id, "Connected to Mainsail. Uploading file...")
+            start_time = time.monotonic()
+            last_update = [0.0]
+            
+            def progress(bytes_sent, total_bytes):
+                now = time.monotonic()
+                if now - last_update[0] < UPLOAD_PROGRESS_INTERVAL and bytes_sent != total_bytes:
+                    return
+                last_update[0] = now
+                self.upload_progress.emit(job_id, bytes_sent, total_bytes, bytes_sent / 1e6 / max(now - start_time, 1e-9))
+            
+            if not await upload_file(client, file_path, progress):
+                self.upload_status.emit(job_id, "Upload failed. See the log for details.")
+                return False
+            self.upload_status.emit(job_id, "File uploaded successfully.")
+            
+            if auto_start_print:
+                await start_print(client, printer_file_name(os.path.basename(file_path)))
+                self.upload_status.emit(job_id, "Print started.")
+            return True
+        finally:
+            await disconnect_from_printer(client)
+            self.upload_status.emit(job_id, "Disconnected from Mainsail.")
+
 class GCodeViewer(QWidget):
     offset_changed = Signal(QPointF)  # New signal
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.gcode_paths = []
+        self.gcode_points = np.empty((0, 2), dtype=np.float32)  # One XY position per move
+        self._points_buffer = self.gcode_points  # Grows geometrically while a file loads
+        self._toolpath_cache = None  # Toolpath pixmap for the current zoom level
+        self._cache_scale = None
+        self._cache_origin = (0.0, 0.0)  # Bed position of the pixmap's top-left corner
+        self._cache_bounds = None  # Toolpath bounds the pixmap was sized for
+        self._cache_count = 0  # Number of moves already drawn into the pixmap
+        self._cache_viewport = False  # Whether the pixmap only covers the area around the view
+        self._segment_grid = None  # Spatial index of the moves, for views too large to cache
         self.gcode_offset = QPointF(0, 0)
         self.dragging = False
         self.last_pos = QPointF(0, 0)
@@ -22,46 +248,66 @@ class GCodeViewer(QWidget):
         self.min_y = float('inf')
         self.max_x = float('-inf')
         self.max_y = float('-inf')
-        self.bed_size = (220, 220)
+        self.bed_size = BED_SIZE
+        self._keep_view = False  # Keep zoom and offset when the next moves arrive
+
+    def load_gcode(self, filename, ranges=None):
+        # ranges limits loading to parts of the file, see layer_index.layer_ranges
+        self.clear_moves()
+        self.append_moves(load_moves(filename, ranges, cache=True))
+        self.set_segment_grid(SegmentGrid(self.gcode_points))
+        self.print_summary()
+
+    def clear_moves(self, keep_view=False):
+        self._keep_view = keep_view
+        self.gcode_points = self._points_buffer = np.empty((0, 2), dtype=np.float32)
+        self._toolpath_cache = None
+        self._cache_scale = None
+        self._segment_grid = None
+        self.min_x = self.min_y = float('inf')
+        self.max_x = self.max_y = float('-inf')
+        self.update()
 
-    def load_gcode(self, filename):
-        self.gcode_paths = []
-        self.min_x = float('inf')
-        self.min_y = float('inf')
-        self.max_x = float('-inf')
-        self.max_y = float('-inf')
+    def append_moves(self, points):
+        # Add moves to the end of the toolpath. The buffer doubles in size when
+        # full so loading a file in many batches stays linear.
+        if not len(points):
+            return
+        count = len(self.gcode_points)
+        if not count:
+            # Take the first batch as is, so moves memory-mapped from the
+            # cache stay shared with the page cache. It is full, so the next
+            # batch copies it into a new buffer instead of writing into it.
+            self._points_buffer = points
+        else:
+            if count + len(points) > len(self._points_buffer):
+                buffer = np.empty((max(2 * len(self._points_buffer), count + len(points)), 2), dtype=np.float32)
+                buffer[:count] = self.gcode_points
+                self._points_buffer = buffer
+            self._points_buffer[count:count + len(points)] = points
+        self.gcode_points = self._points_buffer[:count + len(points)]
         
-        with open(filename, 'r') as file:
-            for line in file:
-                if line.startswith(('G0', 'G1')):
-                    parts = line.split()
-                    new_pos = QPointF()
-                    for part in parts:
-                        if part.startswith('X'):
-                            new_pos.setX(float(part[1:]))
-                        elif part.startswith('Y'):
-                            new_pos.setY(float(part[1:]))
-                    
-                    if len(self.gcode_paths) == 0:
-                        self.gcode_paths.append((new_pos, new_pos))
-                    else:
-                        self.gcode_paths.append((self.gcode_paths[-1][1], new_pos))
-                    
-                    # Update min and max coordinates
-                    self.min_x = min(self.min_x, new_pos.x())
-                    self.min_y = min(self.min_y, new_pos.y())
-                    self.max_x = max(self.max_x, new_pos.x())
-                    self.max_y = max(self.max_y, new_pos.y())
-        
-        print(f"Loaded {len(self.gcode_paths)} paths")
+        min_x, min_y, max_x, max_y = move_bounds(points)
+        self.min_x, self.min_y = min(self.min_x, min_x), min(self.min_y, min_y)
+        self.max_x, self.max_y = max(self.max_x, max_x), max(self.max_y, max_y)
+        if not count and not self._keep_view:
+            self.fit_view()
+        self.update()
+
+    def set_segment_grid(self, grid):
+        # Only an index of exactly the loaded moves is used, until then
+        # zoomed-in views draw every move
+        if grid.count == len(self.gcode_points):
+            self._segment_grid = grid
+            self.update()
+
+    def print_summary(self):
+        print(f"Loaded {len(self.gcode_points)} moves")
         print(f"Min X: {self.min_x}, Max X: {self.max_x}")
         print(f"Min Y: {self.min_y}, Max Y: {self.max_y}")
-        
-        self.fit_view()
-        self.update()
 
     def fit_view(self):
-        if self.gcode_paths:
+        if len(self.gcode_points):
             width = self.max_x - self.min_x
             height = self.max_y - self.min_y
             
@@ -87,21 +333,151 @@ class GCodeViewer(QWidget):
         self.draw_grid(painter, bed_rect)
         
         # Draw the GCode
-        painter.save()
-        painter.setClipRect(bed_rect)
-        painter.translate(bed_rect.topLeft())
-        painter.scale(self.scale_factor, -self.scale_factor)  # Invert Y-axis
-        painter.translate(self.gcode_offset)
-        painter.translate(0, -self.bed_size[1])  # Translate to bottom-left corner
+        if len(self.gcode_points):
+            painter.save()
+            painter.setClipRect(bed_rect)
+            pixmap = self._toolpath_pixmap(bed_rect)
+            if pixmap is not None:
+                # Dragging only moves the cached image, the toolpath is not redrawn
+                origin_x, origin_y = self._cache_origin
+                painter.drawPixmap(QPointF(
+                    bed_rect.left() + (origin_x + self.gcode_offset.x()) * self.scale_factor,
+                    bed_rect.top() + (self.bed_size[1] - origin_y - self.gcode_offset.y()) * self.scale_factor
+                ), pixmap)
+            else:
+                runs = self._visible_runs(bed_rect)
+                painter.translate(bed_rect.topLeft())
+                painter.scale(self.scale_factor, -self.scale_factor)  # Invert Y-axis
+                painter.translate(self.gcode_offset)
+                painter.translate(0, -self.bed_size[1])  # Translate to bottom-left corner
+                painter.setPen(self._toolpath_pen())
+                for first, last in runs:
+                    painter.drawPolyline(points_to_polygon(decimate_points(self.gcode_points[first:last + 1], 1 / self.scale_factor)))
+            painter.restore()
+
+    def _visible_region(self, bed_rect):
+        # (min X, min Y, max X, max Y) of the toolpath that is on screen, in
+        # toolpath coordinates, or None when the bed is off screen
+        visible = QRectF(self.rect()).intersected(bed_rect)
+        if visible.isEmpty():
+            return None
+        # Widget to toolpath coordinates, undoing the drag offset
+        return (
+            (visible.left() - bed_rect.left()) / self.scale_factor - self.gcode_offset.x(),
+            (bed_rect.bottom() - visible.bottom()) / self.scale_factor - self.gcode_offset.y(),
+            (visible.right() - bed_rect.left()) / self.scale_factor - self.gcode_offset.x(),
+            (bed_rect.bottom() - visible.top()) / self.scale_factor - self.gcode_offset.y()
+        )
 
+    def _visible_runs(self, bed_rect):
+        # Zoomed in too far for a cached pixmap: look up the runs of moves in
+        # the visible part of the bed, so drawing scales with what is on screen
+        if self._segment_grid is None:
+            return [(0, len(self.gcode_points) - 1)]
+        region = self._visible_region(bed_rect)
+        return self._segment_grid.visible_runs(*region) if region is not None else []
+
+    def _toolpath_pen(self):
         pen = QPen(QColor(0, 0, 255))
         pen.setWidth(1 / self.scale_factor)
-        painter.setPen(pen)
-
-        for start, end in self.gcode_paths:
-            painter.drawLine(start, end)
+        return pen
+
+    def _toolpath_pixmap(self, bed_rect):
+        # The toolpath rendered into a pixmap that is reused between repaints.
+        # Once the spatial index is there, a zoom level at which the whole
+        # toolpath would be larger than the visible part of the bed only
+        # renders the moves around that part. Returns None when there is
+        # nothing to render or the pixmap would be too large.
+        if self._segment_grid is not None:
+            visible = QRectF(self.rect()).intersected(bed_rect)
+            width, height = self._pixmap_size(self.min_x, self.min_y, self.max_x, self.max_y)
+            if width * height > visible.width() * visible.height():
+                return self._viewport_pixmap(bed_rect)
+        return self._full_pixmap()
+
+    def _pixmap_size(self, min_x, min_y, max_x, max_y):
+        # Size in widget pixels of a pixmap covering the given toolpath area
+        return ((max_x - min_x) * self.scale_factor + 2 * CACHE_PADDING,
+                (max_y - min_y) * self.scale_factor + 2 * CACHE_PADDING)
+
+    def _full_pixmap(self):
+        # Render the toolpath once per zoom level into a pixmap covering its
+        # bounding box. Returns None when that pixmap would be too large.
+        margin = 0.0
+        if self._cache_scale == self.scale_factor and not self._cache_viewport:
+            if self._toolpath_cache is None or self._cache_count == len(self.gcode_points):
+                return self._toolpath_cache
+            cache_min_x, cache_min_y, cache_max_x, cache_max_y = self._cache_bounds
+            if cache_min_x <= self.min_x and cache_min_y <= self.min_y and self.max_x <= cache_max_x and self.max_y <= cache_max_y:
+                # Moves were appended inside the cached area, only draw those
+                self._draw_toolpath(self._toolpath_cache, [(self._cache_count - 1, len(self.gcode_points) - 1)])
+                return self._toolpath_cache
+            # The toolpath is still growing (the file is loading), leave room
+            # around it so the next batches do not force another full render
+            margin = CACHE_GROWTH * max(self.max_x - self.min_x, self.max_y - self.min_y)
+        
+        bounds = (self.min_x - margin, self.min_y - margin, self.max_x + margin, self.max_y + margin)
+        return self._render_pixmap(bounds, [(0, len(self.gcode_points) - 1)], viewport=False)
+
+    def _viewport_pixmap(self, bed_rect):
+        # Render the moves the spatial index finds around the visible part of
+        # the toolpath, reusing the pixmap until the view leaves the area it
+        # covers or the zoom level changes
+        region = self._visible_region(bed_rect)
+        if region is None:
+            return None
+        min_x, min_y, max_x, max_y = region
+        if self._cache_scale == self.scale_factor and self._cache_viewport and self._toolpath_cache is not None:
+            cache_min_x, cache_min_y, cache_max_x, cache_max_y = self._cache_bounds
+            if cache_min_x <= min_x and cache_min_y <= min_y and max_x <= cache_max_x and max_y <= cache_max_y:
+                return self._toolpath_cache
         
-        painter.restore()
+        # The margins shrink on high-DPI screens so the pixmap stays within
+        # MAX_CACHE_DIMENSION
+        largest = (MAX_CACHE_DIMENSION / self.devicePixelRatioF() - 2 * CACHE_PADDING - 1) / self.scale_factor
+        if max(max_x - min_x, max_y - min_y) > largest:
+            return None
+        margin_x = min(VIEWPORT_CACHE_MARGIN * (max_x - min_x), (largest - (max_x - min_x)) / 2)
+        margin_y = min(VIEWPORT_CACHE_MARGIN * (max_y - min_y), (largest - (max_y - min_y)) / 2)
+        bounds = (min_x - margin_x, min_y - margin_y, max_x + margin_x, max_y + margin_y)
+        return self._render_pixmap(bounds, self._segment_grid.visible_runs(*bounds), viewport=True)
+
+    def _render_pixmap(self, bounds, runs, viewport):
+        # Draw the given runs of moves into a new pixmap covering bounds and
+        # make it the cached one. Returns None when it would be too large.
+        self._cache_scale = self.scale_factor
+        self._cache_bounds = bounds
+        self._cache_viewport = viewport
+        self._toolpath_cache = None
+        ratio = self.devicePixelRatioF()
+        width, height = self._pixmap_size(*bounds)
+        if max(width, height) * ratio > MAX_CACHE_DIMENSION:
+            return None
+        
+        pixmap = QPixmap(math.ceil(width * ratio), math.ceil(height * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+        self._draw_toolpath(pixmap, runs)
+        
+        padding = CACHE_PADDING / self.scale_factor
+        self._cache_origin = (bounds[0] - padding, bounds[3] + padding)
+        self._toolpath_cache = pixmap
+        return pixmap
+
+    def _draw_toolpath(self, pixmap, runs):
+        # Draw runs of moves, (first move, last move) pairs, into the cached pixmap
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
+        min_x, _, _, max_y = self._cache_bounds
+        painter.translate(CACHE_PADDING - min_x * self.scale_factor, CACHE_PADDING + max_y * self.scale_factor)
+        painter.scale(self.scale_factor, -self.scale_factor)  # Invert Y-axis
+        painter.setPen(self._toolpath_pen())
+        # Level of detail: one cell per device pixel
+        cell_size = 1 / (self.scale_factor * pixmap.devicePixelRatio())
+        for first, last in runs:
+            painter.drawPolyline(points_to_polygon(decimate_points(self.gcode_points[first:last + 1], cell_size)))
+        painter.end()
+        self._cache_count = len(self.gcode_points)
 
     def draw_grid(self, painter, bed_rect):
         grid_color = QColor(200, 200, 200)
@@ -221,6 +597,22 @@ class ConfigDialog(QDialog):
         self.watch_interval_input = QLineEdit(self.config.get('Script', 'watch_interval'))
         layout.addRow("Watch Interval:", self.watch_interval_input)
         
+        self.watch_backend_input = QComboBox()
+        self.watch_backend_input.addItems(WATCH_BACKENDS)
+        self.watch_backend_input.setCurrentText(self.config.get('Script', 'watch_backend', fallback='auto'))
+        layout.addRow("Watch Backend:", self.watch_backend_input)
+        
+        self.translate_engine_input = QComboBox()
+        self.translate_engine_input.addItems(TRANSLATE_ENGINES)
+        self.translate_engine_input.setCurrentText(self.config.get('Script', 'translate_engine', fallback='legacy'))
+        layout.addRow("Translate Engine:", self.translate_engine_input)
+        
+        self.workers_input = QLineEdit(self.config.get('Script', 'workers', fallback='1'))
+        layout.addRow("Workers:", self.workers_input)
+        
+        self.translate_workers_input = QLineEdit(self.config.get('Script', 'translate_workers', fallback='1'))
+        layout.addRow("Translate Workers:", self.translate_workers_input)
+        
         save_button = QPushButton("Save Config")
         save_button.clicked.connect(self.save_config)
         layout.addRow(save_button)
@@ -234,6 +626,10 @@ class ConfigDialog(QDialog):
         self.config.set('Script', 'include_timestamp', self.include_timestamp_input.currentText())
         self.config.set('Script', 'autowatch', self.autowatch_input.currentText())
         self.config.set('Script', 'watch_interval', self.watch_interval_input.text())
+        self.config.set('Script', 'watch_backend', self.watch_backend_input.currentText())
+        self.config.set('Script', 'translate_engine', self.translate_engine_input.currentText())
+        self.config.set('Script', 'workers', self.workers_input.text())
+        self.config.set('Script', 'translate_workers', self.translate_workers_input.text())
         
         with open(self.config_file_path, 'w') as configfile:
             self.config.write(configfile)
@@ -275,6 +671,12 @@ class MainWindow(QMainWindow):
         config_button.clicked.connect(self.show_config_dialog)
         button_layout.addWidget(config_button)
 
+        self.layers_input = QLineEdit()
+        self.layers_input.setPlaceholderText("Layers, e.g. 1-10")
+        self.layers_input.setMaximumWidth(120)
+        self.layers_input.returnPressed.connect(self.show_layers)
+        button_layout.addWidget(self.layers_input)
+
         self.offset_label = QLabel("Offset: X=0.00, Y=0.00")
         button_layout.addWidget(self.offset_label)
 
@@ -285,7 +687,31 @@ class MainWindow(QMainWindow):
         self.status_area.setMaximumHeight(150)  # Limit the height of the status area
         layout.addWidget(self.status_area)
 
+        self.load_progress = QProgressBar()
+        self.load_progress.setFormat("Loading... %p%")
+        self.load_progress.hide()
+        layout.addWidget(self.load_progress)
+
+        upload_layout = QHBoxLayout()
+        layout.addLayout(upload_layout)
+        
+        self.upload_progress = QProgressBar()
+        self.upload_progress.hide()
+        upload_layout.addWidget(self.upload_progress)
+        
+        self.cancel_upload_button = QPushButton("Cancel Upload")
+        self.cancel_upload_button.clicked.connect(self.cancel_upload)
+        self.cancel_upload_button.hide()
+        upload_layout.addWidget(self.cancel_upload_button)
+
+        self.uploader = None  # UploadWorker, started by the first upload
+        self.upload_jobs = {}  # Queued and running uploads, job id -> file name
+
+        self.loader = None  # Background GCodeLoader for the file being opened
         self.current_file = None
+        self.viewed_file = None  # File shown in the viewer, before any fix
+        self.template = None  # Compiled viewed_file, built on the first fix
+        self.fits_bed = True  # Whether the last fixed file stays on the bed
         self.config_file_path = 'config.ini'
         self.config = configparser.ConfigParser()
         self.config.read(self.config_file_path)
@@ -300,12 +726,69 @@ class MainWindow(QMainWindow):
         if filename:
             self.update_status(f"Loading file: {filename}")
             self.current_file = filename
-            self.gcode_viewer.load_gcode(filename)
-            self.update_offset_label(self.gcode_viewer.get_offset())
-            self.update_status("File loaded successfully.")
+            self.viewed_file = filename
+            self.template = None
+            self.fits_bed = True
+            self.start_loading(filename)
+
+    def show_layers(self):
+        # Reload the viewed file with only the selected layers, keeping the view
+        if not self.viewed_file:
+            self.update_status("No file loaded. Please load a GCode file first.")
+            return
+        layers = self.layers_input.text().strip()
+        self.update_status(f"Showing layers {layers}" if layers else "Showing all layers")
+        self.start_loading(self.viewed_file, keep_view=True)
+
+    def start_loading(self, filename, keep_view=False):
+        self.cancel_loading()
+        self.gcode_viewer.clear_moves(keep_view)
+        self.load_progress.setValue(0)
+        self.load_progress.show()
+        
+        self.loader = GCodeLoader(filename, self.layers_input.text(), self)
+        self.loader.moves_loaded.connect(self.on_moves_loaded)
+        self.loader.loading_finished.connect(self.on_loading_finished)
+        self.loader.loading_failed.connect(self.on_loading_failed)
+        self.loader.start()
+
+    def cancel_loading(self):
+        if self.loader is not None:
+            if self.loader.isRunning():
+                self.update_status("Cancelled loading the previous file.")
+            self.loader.requestInterruption()
+            self.loader.wait()
+            self.loader = None
+            self.load_progress.hide()
+
+    def on_moves_loaded(self, points, bytes_read, total_size):
+        # Batches from a cancelled loader can still be queued, ignore them
+        if self.sender() is not self.loader:
+            return
+        self.gcode_viewer.append_moves(points)
+        self.load_progress.setValue(int(100 * bytes_read / max(total_size, 1)))
+        self.update_offset_label(self.gcode_viewer.get_offset())
+
+    def on_loading_finished(self, move_count, segment_grid):
+        if self.sender() is not self.loader:
+            return
+        self.loader = None
+        self.load_progress.hide()
+        self.gcode_viewer.set_segment_grid(segment_grid)
+        self.gcode_viewer.print_summary()
+        self.update_status(f"File loaded successfully ({move_count} moves).")
+
+    def on_loading_failed(self, message):
+        if self.sender() is not self.loader:
+            return
+        self.loader = None
+        self.load_progress.hide()
+        self.update_status(f"Failed to load file: {message}")
 
     def fix_gcode(self):
-        if not self.current_file:
+        # Always translate the file that was loaded: the viewer offset is
+        # relative to it, not to the output of an earlier fix
+        if not self.viewed_file:
             self.update_status("No file loaded. Please load a GCode file first.")
             return
 
@@ -318,15 +801,31 @@ class MainWindow(QMainWindow):
         output_directory = 'fixed'
         os.makedirs(output_directory, exist_ok=True)
         
-        base_name = os.path.basename(self.current_file)
+        base_name = os.path.basename(self.viewed_file)
         name, ext = os.path.splitext(base_name)
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         new_filename = f"{name}-FIXED_X{x_offset:.1f}_Y{y_offset:.1f}_{timestamp}{ext}"
         output_file_path = os.path.join(output_directory, new_filename)
 
-        translate_gcode(self.current_file, output_file_path, -x_offset, -y_offset)
+        engine = self.config.get('Script', 'translate_engine', fallback='legacy')
+        translate_workers = self.config.getint('Script', 'translate_workers', fallback=1)
+        if os.path.getsize(self.viewed_file) > MAX_TEMPLATE_FILE_SIZE:
+            # Forking would copy the Qt and upload threads into the range
+            # workers, so they are started fresh instead
+            summary = translate_gcode(self.viewed_file, output_file_path, -x_offset, -y_offset, engine, translate_workers, analyze=True,
+                                      mp_context=multiprocessing.get_context('spawn'))
+        else:
+            if self.template is None or self.template.engine != engine:
+                self.template = compile_template(self.viewed_file, engine)
+            summary = self.template.write(output_file_path, -x_offset, -y_offset, analyze=True)
+        write_summary(output_file_path, summary)
         
         self.update_status(f"Fixed GCode saved as: {output_file_path}")
+        self.update_status(describe_summary(summary))
+        bed_size = parse_bed_size(self.config.get('Script', 'bed_size', fallback='220x220'))
+        self.fits_bed = summary_fits_bed(summary, bed_size)
+        if not self.fits_bed:
+            self.update_status(f"Warning: the fixed print goes off the {bed_size[0]:g}x{bed_size[1]:g} mm bed.")
         self.current_file = output_file_path
 
     def upload_to_mainsail(self):
@@ -334,27 +833,60 @@ class MainWindow(QMainWindow):
             self.update_status("No file loaded. Please load or fix a GCode file first.")
             return
 
-        self.update_status("Processing... please wait...")
-        QApplication.processEvents()  # Force the GUI to update
+        if not self.fits_bed and self.config.getboolean('Script', 'bed_check', fallback=True):
+            self.update_status("The fixed print goes off the bed. Fix it with another offset before uploading.")
+            return
 
         url = self.config.get('Moonraker', 'url')
         auto_start_print = self.config.getboolean('Moonraker', 'auto_start_print')
 
-        async def upload():
-            self.update_status(f"Connecting to Mainsail at {url}...")
-            client = await connect_to_printer(url)
-            if client:
-                self.update_status("Connected to Mainsail. Uploading file...")
-                await upload_file(client, self.current_file)
-                self.update_status("File uploaded successfully.")
-                if auto_start_print:
-                    self.update_status("Auto-start print is enabled, but not implemented in this version.")
-                await client.disconnect()
-                self.update_status("Disconnected from Mainsail.")
-            else:
-                self.update_status("Failed to connect to Mainsail.")
-
-        asyncio.run(upload())
+        file_name = os.path.basename(self.current_file)
+        job_id = self.get_uploader().enqueue(url, self.current_file, auto_start_print)
+        if self.upload_jobs:
+            self.update_status(f"Queued upload of {file_name} ({len(self.upload_jobs)} ahead of it).")
+        else:
+            self.update_status(f"Uploading {file_name}...")
+            self.upload_progress.setRange(0, 0)
+            self.upload_progress.setFormat(f"{file_name}: connecting...")
+        self.upload_jobs[job_id] = file_name
+        self.upload_progress.show()
+        self.cancel_upload_button.show()
+
+    def get_uploader(self):
+        if self.uploader is None:
+            self.uploader = UploadWorker(self)
+            self.uploader.upload_status.connect(self.on_upload_status)
+            self.uploader.upload_progress.connect(self.on_upload_progress)
+            self.uploader.upload_finished.connect(self.on_upload_finished)
+            self.uploader.start()
+        return self.uploader
+
+    def cancel_upload(self):
+        # Uploads run in the order they were queued, so the oldest one is running
+        if self.upload_jobs:
+            self.uploader.cancel(min(self.upload_jobs))
+
+    def on_upload_status(self, job_id, message):
+        self.update_status(f"{self.upload_jobs.get(job_id, '')}: {message}")
+
+    def on_upload_progress(self, job_id, bytes_sent, total_bytes, rate):
+        file_name = self.upload_jobs.get(job_id, '')
+        if total_bytes:
+            self.upload_progress.setRange(0, 100)
+            self.upload_progress.setValue(int(100 * bytes_sent / total_bytes))
+            self.upload_progress.setFormat(f"{file_name}: {bytes_sent / 1e6:.1f} of {total_bytes / 1e6:.1f} MB ({rate:.1f} MB/s)")
+        else:
+            self.upload_progress.setRange(0, 0)
+            self.upload_progress.setFormat(f"{file_name}: {bytes_sent / 1e6:.1f} MB ({rate:.1f} MB/s)")
+
+    def on_upload_finished(self, job_id, success):
+        self.upload_jobs.pop(job_id, None)
+        if self.upload_jobs:
+            self.upload_progress.setRange(0, 0)
+            self.upload_progress.setFormat(f"{self.upload_jobs[min(self.upload_jobs)]}: connecting...")
+        else:
+            self.upload_progress.hide()
+            self.cancel_upload_button.hide()
 
     def show_config_dialog(self):
         config_dialog = ConfigDialog(self.config_file_path)
@@ -367,6 +899,12 @@ class MainWindow(QMainWindow):
     def update_offset_label(self, offset):
         self.offset_label.setText(f"Offset: X={offset.x():.2f}, Y={offset.y():.2f}")
 
+    def closeEvent(self, event):
+        self.cancel_loading()
+        if self.uploader is not None:
+            self.uploader.stop()
+        super().closeEvent(event)
+
 def main():
     app = QApplication(sys.argv)
     window = MainWindow()
@@ -0,0 +1,139 @@
+import collections
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import re
+import time
+
+# Per-stage timing of the pipeline (translate, connect, upload, start_print,
+# process_files). Every finished stage is one record: appended to a JSON-lines
+# log when one is configured, and summed per stage for the Prometheus textfile
+# written by write_prometheus(). Nothing is written until configure() is called.
+
+class MetricsRecorder:
+    def __init__(self):
+        self.jsonl_path = None
+        self.prometheus_path = None
+        self.profile_directory = None
+        self.totals = collections.defaultdict(lambda: {'runs': 0, 'failures': 0, 'seconds': 0.0, 'bytes': 0, 'lines': 0, 'last_seconds': 0.0})
+        self._captured = None  # Records kept for the parent process, see capture()
+
+    def record(self, stage, seconds, bytes=0, lines=0, ok=True, **labels):
+        record = {'time': round(time.time(), 3), 'stage': stage, 'seconds': round(seconds, 6), 'ok': ok}
+        if bytes:
+            record['bytes'] = bytes
+            record['mb_per_s'] = round(bytes / 1e6 / max(seconds, 1e-9), 2)
+        if lines:
+            record['lines'] = lines
+            record['lines_per_s'] = round(lines / max(seconds, 1e-9))
+        record.update(labels)
+        self.add(record)
+
+    def add(self, record):
+        if self._captured is not None:
+            self._captured.append(record)
+            return
+
+        totals = self.totals[record['stage']]
+        totals['runs'] += 1
+        totals['failures'] += not record['ok']
+        totals['seconds'] += record['seconds']
+        totals['bytes'] += record.get('bytes', 0)
+        totals['lines'] += record.get('lines', 0)
+        totals['last_seconds'] = record['seconds']
+
+        if self.jsonl_path:
+            try:
+                with open(self.jsonl_path, 'a') as file:
+                    file.write(json.dumps(record) + '\n')
+            except OSError as e:
+                logging.warning(f"Could not write metrics to {self.jsonl_path}: {e}")
+
+    def write_prometheus(self):
+        # Written to a temporary file and renamed, as the node_exporter
+        # textfile collector expects
+        if not self.prometheus_path:
+            return
+        lines = []
+        for name, key, kind, help_text in _PROMETHEUS_METRICS:
+            lines.append(f"# HELP canvass_{name} {help_text}")
+            lines.append(f"# TYPE canvass_{name} {kind}")
+            for stage, totals in sorted(self.totals.items()):
+                lines.append(f'canvass_{name}{{stage="{_escape_label(stage)}"}} {totals[key]}')
+        temp_path = self.prometheus_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as file:
+                file.write('\n'.join(lines) + '\n')
+            os.replace(temp_path, self.prometheus_path)
+        except OSError as e:
+            logging.warning(f"Could not write metrics to {self.prometheus_path}: {e}")
+
+    @contextlib.contextmanager
+    def capture(self):
+        # Collect records instead of writing them, so a worker process can hand
+        # them back to the parent (see replay)
+        self._captured = []
+        try:
+            yield self._captured
+        finally:
+            self._captured = None
+
+    def replay(self, records):
+        for record in records:
+            self.add(record)
+
+_PROMETHEUS_METRICS = (
+    ('stage_runs_total', 'runs', 'counter', "Number of times the stage ran"),
+    ('stage_failures_total', 'failures', 'counter', "Number of times the stage failed"),
+    ('stage_seconds_total', 'seconds', 'counter', "Time spent in the stage"),
+    ('stage_bytes_total', 'bytes', 'counter', "Bytes handled by the stage"),
+    ('stage_lines_total', 'lines', 'counter', "G-code lines handled by the stage"),
+    ('stage_last_seconds', 'last_seconds', 'gauge', "Duration of the last run of the stage"),
+)
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+recorder = MetricsRecorder()
+
+def configure(jsonl_path=None, prometheus_path=None, profile_directory=None):
+    recorder.jsonl_path = jsonl_path
+    recorder.prometheus_path = prometheus_path
+    recorder.profile_directory = profile_directory
+    if profile_directory:
+        os.makedirs(profile_directory, exist_ok=True)
+
+@contextlib.contextmanager
+def stage(name, **labels):
+    # Time the body and record it as one run of stage name. The body can fill
+    # in the yielded dict: bytes, lines, ok and any extra labels for the log.
+    info = {}
+    start_time = time.perf_counter()
+    try:
+        yield info
+    except BaseException:
+        info['ok'] = False
+        raise
+    finally:
+        labels.update(info)
+        recorder.record(name, time.perf_counter() - start_time, **labels)
+
+@contextlib.contextmanager
+def profiled(name):
+    # Run the body under cProfile when a profile directory is configured and
+    # dump the stats there as <name>-<timestamp>.prof
+    if not recorder.profile_directory:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        safe_name = re.sub(r'[^\w\-.]', '_', name)
+        path = os.path.join(recorder.profile_directory, f"{safe_name}-{time.strftime('%Y%m%d_%H%M%S')}-{os.getpid()}.prof")
+        profile.dump_stats(path)
+        logging.info(f"Wrote translation profile to {path}")
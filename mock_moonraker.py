@@ -0,0 +1,37 @@
+# A local stand-in for the parts of Moonraker that uploads talk to, used by
+# the benchmarks and the tests so neither needs a printer
+
+async def start_mock_moonraker(host='127.0.0.1', port=0):
+    # Minimal stand-in for Moonraker's upload and metadata endpoints. Uploaded
+    # bodies are read and discarded, only their sizes are kept.
+    from aiohttp import web
+
+    files = {}
+
+    async def upload(request):
+        reader = await request.multipart()
+        field = await reader.next()
+        size = 0
+        while True:
+            chunk = await field.read_chunk(1024 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+        files[field.filename] = size
+        return web.json_response({'item': {'path': field.filename, 'root': 'gcodes', 'size': size}, 'action': 'create_file'}, status=201)
+
+    async def metadata(request):
+        file_name = request.query.get('filename')
+        if file_name not in files:
+            return web.json_response({'error': 'not found'}, status=404)
+        return web.json_response({'result': {'filename': file_name, 'size': files[file_name]}})
+
+    app = web.Application(client_max_size=0)
+    app.router.add_post('/server/files/upload', upload)
+    app.router.add_get('/server/files/metadata', metadata)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_host, bound_port = runner.addresses[0][:2]
+    return runner, f"http://{bound_host}:{bound_port}"
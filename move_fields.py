@@ -0,0 +1,281 @@
+import re
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Bytes appended to a block so that looking past its end reads zeros, and the
+# bytes read at once to find where a number ends
+_PADDING = b'\0' * 32
+_NUMBER_WINDOW = 16
+
+# Numbers parsed with integer arithmetic have at most this many digits, so the
+# digits fit in the 53 bits of a float64 exactly. Longer ones go through float().
+_MAX_EXACT_DIGITS = 15
+_POWERS_OF_TEN = np.array([float(f'1e{k}') for k in range(_MAX_EXACT_DIGITS + 1)])
+
+# A tool change line, matched at the start of a line
+_TOOL_RE = re.compile(rb'T(\d+)(?![0-9.])')
+
+def _is_number(codes):
+    # [\d.]
+    return ((codes >= ord('0')) & (codes <= ord('9'))) | (codes == ord('.'))
+
+def _number_ends(buffer, starts):
+    # End of the run of [\d.] bytes that begins at each start, looking at the
+    # next _NUMBER_WINDOW bytes of all of them at once. The rare longer runs
+    # are followed further one byte at a time.
+    rows = _is_number(sliding_window_view(buffer, _NUMBER_WINDOW)[np.minimum(starts, len(buffer) - _NUMBER_WINDOW)])
+    first = np.argmin(rows, axis=1)
+    ends = starts + first
+    longer = np.flatnonzero(np.take_along_axis(rows, first[:, None], axis=1)[:, 0])
+    ends[longer] += _NUMBER_WINDOW
+    while len(longer):
+        longer = longer[_is_number(buffer[ends[longer]])]
+        ends[longer] += 1
+    return ends
+
+class MoveFields:
+    # The X/Y values of the G0/G1 lines of a block of whole lines, found with
+    # whole-array operations instead of a regular expression per line. Lines
+    # match exactly as they would with
+    #   \nG0?[01](?![0-9.])[^\n;XY]*([XY])([-+]?[\d.]+)(?:[^\n;XY]*([XY])([-+]?[\d.]+))?
+    # so a line has at most two fields, the first X/Y word and the one after
+    # it, and nothing after a ';' counts. starts and ends delimit each value
+    # (sign included) within the block, in the order they appear.
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        # The leading newline puts the first line on the same footing as the
+        # others; positions in buffer are one past those in chunk
+        buffer = self.buffer = np.frombuffer(b'\n' + chunk + _PADDING, dtype=np.uint8)
+        line_starts = self._line_starts = np.flatnonzero(buffer == ord('\n')) + 1
+        lines = line_starts[buffer[line_starts] == ord('G')]
+
+        # G0?[01](?![0-9.]): G0 and G1 end two bytes in, G00 and G01 three
+        first, second, third = buffer[lines + 1], buffer[lines + 2], buffer[lines + 3]
+        short = ((first == ord('0')) | (first == ord('1'))) & ~_is_number(second)
+        long = (first == ord('0')) & ((second == ord('0')) | (second == ord('1'))) & ~_is_number(third)
+        is_move = short | long
+        self.lines = lines[is_move]  # Where each G0/G1 line starts in buffer
+        self.command_ends = np.where(short, lines + 2, lines + 3)[is_move]
+
+        # The first byte that can end a [^\n;XY]* run after each point, with a
+        # (zero) padding byte standing in when there is none
+        self._stops = np.append(np.flatnonzero(
+            (buffer == ord('X')) | (buffer == ord('Y')) | (buffer == ord(';')) | (buffer == ord('\n'))
+        ), len(buffer) - 2)
+
+        first_found, first_is_x, first_starts, first_ends = self._find_field(self.command_ends)
+        # A line whose first X/Y word has no value does not match at all
+        self.move_lines = np.flatnonzero(first_found)  # Indices into lines
+        first_is_x, first_starts, first_ends = first_is_x[first_found], first_starts[first_found], first_ends[first_found]
+        second_found, second_is_x, second_starts, second_ends = self._find_field(first_ends)
+
+        # Interleave the first and second field of every line, then drop the
+        # second fields that are missing
+        count = len(first_starts)
+        self.starts = np.empty(2 * count, dtype=np.int64)
+        self.ends = np.empty(2 * count, dtype=np.int64)
+        self.is_x = np.empty(2 * count, dtype=bool)
+        self.moves = np.repeat(np.arange(count), 2)  # Index into move_lines of each field
+        found = np.ones(2 * count, dtype=bool)
+        self.starts[0::2], self.starts[1::2] = first_starts - 1, second_starts - 1
+        self.ends[0::2], self.ends[1::2] = first_ends - 1, second_ends - 1
+        self.is_x[0::2], self.is_x[1::2] = first_is_x, second_is_x
+        found[1::2] = second_found
+        if not second_found.all():
+            self.starts, self.ends, self.is_x, self.moves = self.starts[found], self.ends[found], self.is_x[found], self.moves[found]
+
+    def _find_field(self, after):
+        # The X/Y word ending each [^\n;XY]* run that starts at after, as
+        # (found, is X, value start, value end) with positions in buffer
+        buffer = self.buffer
+        axes = self._stops[np.searchsorted(self._stops, after)]
+        codes = buffer[axes]
+        starts = axes + 1
+        signs = (buffer[starts] == ord('-')) | (buffer[starts] == ord('+'))
+        digits = starts + signs
+        ends = _number_ends(buffer, digits)
+        found = ((codes == ord('X')) | (codes == ord('Y'))) & (ends > digits)
+        return found, codes == ord('X'), starts, ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def values(self):
+        return parse_numbers(self.buffer, self.starts + 1, self.ends + 1)
+
+    def shifted(self, x_offset, y_offset):
+        return self.values() + np.where(self.is_x, x_offset, y_offset)
+
+    def bounds(self, values):
+        # (min X, min Y, max X, max Y) of values, one for each field, with
+        # infinities for an axis that has none
+        xs = values[self.is_x]
+        ys = values[~self.is_x]
+        return (float(xs.min(initial=np.inf)), float(ys.min(initial=np.inf)),
+                float(xs.max(initial=-np.inf)), float(ys.max(initial=-np.inf)))
+
+    def positions(self, values):
+        # The X and Y values set by every line of move_lines, with values one
+        # for each field, and NaN for an axis a line does not set. When a line
+        # sets an axis twice the later value counts.
+        xs = np.full(len(self.move_lines), np.nan)
+        ys = np.full(len(self.move_lines), np.nan)
+        xs[self.moves[self.is_x]] = values[self.is_x]
+        ys[self.moves[~self.is_x]] = values[~self.is_x]
+        return xs, ys
+
+    def words(self, letter):
+        # The value of the first <letter> word of every G0/G1 line, NaN for
+        # lines without one
+        buffer = self.buffer
+        stops = buffer[self._stops]
+        line_ends = self._stops[(stops == ord(';')) | (stops == ord('\n')) | (self._stops == len(buffer) - 2)]
+        letters = np.append(np.flatnonzero(buffer == ord(letter)), len(buffer) - 2)
+        words = letters[np.searchsorted(letters, self.command_ends)]
+        starts = words + 1
+        digits = starts + ((buffer[starts] == ord('-')) | (buffer[starts] == ord('+')))
+        ends = _number_ends(buffer, digits)
+        found = (words < line_ends[np.searchsorted(line_ends, self.command_ends)]) & (ends > digits)
+        values = np.full(len(self.lines), np.nan)
+        values[found] = parse_numbers(buffer, starts[found], ends[found])
+        return values
+
+    def extruding(self):
+        # Whether each G0/G1 line is an extruding move: a G1 line with X/Y
+        # values and a positive E word
+        is_g1 = self.buffer[self.command_ends - 1] == ord('1')
+        with np.errstate(invalid='ignore'):
+            extruding = is_g1 & (self.words('E') > 0)
+        has_fields = np.zeros(len(self.lines), dtype=bool)
+        has_fields[self.move_lines] = True
+        return extruding & has_fields
+
+    def heights(self, z):
+        # The Z height in effect at every G0/G1 line, starting from z (NaN when
+        # not known yet), and the index of the line that moved to it, -1 when
+        # that was before the block
+        heights = self.words('Z')
+        moved_at = np.where(np.isnan(heights), -1, np.arange(len(heights)))
+        np.maximum.accumulate(moved_at, out=moved_at)
+        return np.where(moved_at >= 0, heights[moved_at], z), moved_at
+
+    def tools(self):
+        # The tool numbers of the tool change lines, in order
+        lines = self._line_starts[self.buffer[self._line_starts] == ord('T')] - 1
+        matches = (_TOOL_RE.match(self.chunk, line) for line in lines.tolist())
+        return [int(match.group(1)) for match in matches if match]
+
+    def cut(self):
+        # The block without its values as a uint8 array, and the offset in it
+        # where each value was
+        chunk = self.buffer[1:len(self.chunk) + 1]
+        value_lengths = self.ends - self.starts
+        text = chunk[_runs(self.starts, value_lengths, len(chunk))]
+        positions = self.starts - (np.cumsum(value_lengths) - value_lengths)
+        return text, positions
+
+    def replace(self, values):
+        # The block as bytes with every value replaced by the matching one of
+        # values, formatted like '%.3f'
+        text, positions = self.cut()
+        return splice_numbers(text, positions, *format_numbers(values)).tobytes()
+
+def parse_numbers(buffer, starts, ends):
+    # float() of every buffer[start:end], each holding [-+]?[\d.]+. The digits
+    # are built into an integer and divided by a power of ten; both are exact
+    # float64 values and division is correctly rounded, so this gives exactly
+    # what float() does. Numbers too long for that go through float(), which
+    # also raises ValueError for malformed ones such as '.' or '1.2.3'.
+    if not len(starts):
+        return np.empty(0, dtype=np.float64)
+    negative = buffer[starts] == ord('-')
+    digit_starts = starts + (negative | (buffer[starts] == ord('+')))
+    lengths = ends - digit_starts
+    width = int(lengths.max())
+    if int(digit_starts.max()) + width > len(buffer):
+        buffer = np.concatenate((buffer, np.zeros(width, dtype=np.uint8)))
+    # One row of width bytes per number, starting at its first digit
+    table = sliding_window_view(buffer, width)[digit_starts]
+    inside = np.arange(width) < lengths[:, None]
+    is_dot = inside & (table == ord('.'))
+    is_digit = inside & ~is_dot
+    dots = is_dot.sum(axis=1)
+    digit_count = lengths - dots
+
+    mantissa = np.zeros(len(starts), dtype=np.int64)
+    for column in range(width):
+        mantissa = np.where(is_digit[:, column], mantissa * 10 + (table[:, column] - ord('0')), mantissa)
+    decimals = np.where(dots > 0, lengths - 1 - is_dot.argmax(axis=1), 0)
+    slow = (digit_count > _MAX_EXACT_DIGITS) | (digit_count == 0) | (dots > 1)
+    values = mantissa / _POWERS_OF_TEN[np.where(slow, 0, decimals)]
+    np.negative(values, out=values, where=negative)
+    for i in np.flatnonzero(slow):
+        values[i] = float(buffer[starts[i]:ends[i]].tobytes())
+    return values
+
+def format_numbers(values):
+    # b'%.3f' % value for every value, as one uint8 array of the formatted
+    # numbers back to back and the length of each. A value is rounded to
+    # thousandths in bulk when it is clearly closer to one than to the next,
+    # so the digits are the same as '%.3f' gives; the rare ones too close to
+    # call, huge or not finite are formatted by Python.
+    scaled = values * 1000.0
+    rounded = np.rint(scaled)
+    with np.errstate(invalid='ignore'):
+        exact = (np.abs(scaled - rounded) <= 0.25) & (np.abs(rounded) < 1e15)
+    thousandths = np.abs(np.where(exact, rounded, 0.0)).astype(np.int64)
+    integers, fractions = np.divmod(thousandths, 1000)
+    negative = np.signbit(values)
+    integer_digits = np.ones(len(values), dtype=np.int64)
+    power = 10
+    while power <= integers.max(initial=0):
+        integer_digits += integers >= power
+        power *= 10
+    lengths = negative + integer_digits + 4
+
+    others = np.flatnonzero(~exact)
+    formatted = [b'%.3f' % value for value in values[others].tolist()]
+    lengths[others] = [len(text) for text in formatted]
+
+    # One right-aligned row per number, read back without the unused columns
+    width = max(int(lengths.max(initial=0)), len(b'0.000'))
+    table = np.empty((len(values), width), dtype=np.uint8)
+    table[:, -1] = ord('0') + fractions % 10
+    table[:, -2] = ord('0') + fractions // 10 % 10
+    table[:, -3] = ord('0') + fractions // 100
+    table[:, -4] = ord('.')
+    for column in range(width - 5, -1, -1):
+        table[:, column] = ord('0') + integers % 10
+        integers = integers // 10
+    signs = np.flatnonzero(negative & exact)
+    table[signs, width - lengths[signs]] = ord('-')
+    for row, text in zip(others, formatted):
+        table[row, width - len(text):] = np.frombuffer(text, dtype=np.uint8)
+    numbers = table[np.arange(width) >= width - lengths[:, None]]
+    return numbers, lengths
+
+def _runs(starts, lengths, size):
+    # Mask of size bytes that is False in the runs of lengths bytes beginning
+    # at starts (sorted, not overlapping) and True elsewhere, built by
+    # repeating True and False for the lengths of the gaps and runs in turn
+    counts = np.empty(2 * len(starts) + 1, dtype=np.int64)
+    counts[0:-1:2] = np.diff(starts, prepend=0)
+    counts[2:-1:2] -= lengths[:-1]
+    counts[1::2] = lengths
+    counts[-1] = size - (starts[-1] + lengths[-1] if len(starts) else 0)
+    pattern = np.ones(len(counts), dtype=bool)
+    pattern[1::2] = False
+    return np.repeat(pattern, counts)
+
+def splice_numbers(text, positions, numbers, lengths):
+    # Insert numbers (back to back, with their lengths) into the uint8 array
+    # text, number k going in at offset positions[k] of text. In the result it
+    # starts that much later again as all the numbers before it take up.
+    starts = positions + (np.cumsum(lengths) - lengths)
+    is_text = _runs(starts, lengths, len(text) + len(numbers))
+    block = np.empty(len(is_text), dtype=np.uint8)
+    block[is_text] = text
+    block[~is_text] = numbers
+    return block
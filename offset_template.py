@@ -0,0 +1,128 @@
+import numpy as np
+
+from gcode_translate import read_line_chunks, TRANSLATE_BUFFER_SIZE, TRANSLATE_ENGINES, TranslationStats
+from move_fields import MoveFields, format_numbers, splice_numbers
+
+# Coordinate values rendered per block. Bounds the temporary index arrays
+# while keeping the number of NumPy calls per file small.
+RENDER_BLOCK_VALUES = 256 * 1024
+
+class OffsetTemplate:
+    # A G-code file compiled for repeated translation: the file's text with
+    # every G0/G1 X/Y value cut out, where each value goes back into that text
+    # and the values themselves. Rendering at an offset is a vectorized add,
+    # formatting and scatter of the new values into the text (see move_fields),
+    # without reading or parsing the file again. The output is byte for byte
+    # what translate_gcode produces with the same engine.
+
+    def __init__(self, text, positions, values, is_x, engine, stats):
+        self.text = np.frombuffer(text, dtype=np.uint8)
+        self.positions = positions  # Offset in text where each value is inserted
+        self.values = values  # float64 original coordinate values
+        self.is_x = is_x  # True for X values, False for Y values
+        self.engine = engine
+        self.stats = stats  # TranslationStats of the original file
+
+    def _render_blocks(self, x_offset, y_offset):
+        yield np.frombuffer(f"; Translated with offsets: X={x_offset}mm, Y={y_offset}mm\n".encode(), dtype=np.uint8)
+        count = len(self.values)
+        text_start = 0
+        for first in range(0, max(count, 1), RENDER_BLOCK_VALUES):
+            last = min(first + RENDER_BLOCK_VALUES, count)
+            text_end = self.positions[last] if last < count else len(self.text)
+            text = self.text[text_start:text_end]
+            if first == last:
+                yield text
+                break
+
+            shifted = self.values[first:last] + np.where(self.is_x[first:last], x_offset, y_offset)
+            numbers, lengths = format_numbers(shifted)
+            yield splice_numbers(text, self.positions[first:last] - text_start, numbers, lengths)
+            text_start = text_end
+
+    def iter_chunks(self, x_offset, y_offset):
+        # Yield the translated file as byte chunks, like iter_translated_chunks
+        for block in self._render_blocks(x_offset, y_offset):
+            yield block.tobytes()
+
+    def write(self, output_file_path, x_offset, y_offset, analyze=False):
+        # Like translate_gcode, returns the summary of the output when analyze
+        # is set. Only the bounds depend on the offsets, and they are moved by
+        # them, so the file does not need to be analyzed again.
+        with open(output_file_path, 'wb', buffering=TRANSLATE_BUFFER_SIZE) as outfile:
+            for block in self._render_blocks(x_offset, y_offset):
+                outfile.write(block)
+        return self.stats.summary(x_offset, y_offset) if analyze else None
+
+def _compile_chunk_fast(chunk, stats):
+    # The same fields _translate_chunk_fast rewrites, cut out of the chunk
+    fields = MoveFields(chunk)
+    values = fields.values()
+    stats.add(fields, values)
+    text, positions = fields.cut()
+    return text.tobytes(), positions, values, fields.is_x
+
+def _compile_lines_legacy(lines, stats):
+    # Mirror _translate_lines: movement lines are re-joined from their tokens
+    # and each X/Y token becomes its axis letter followed by an insertion point
+    pieces = []
+    positions = []
+    values = []
+    is_x = []
+    length = 0
+    for line in lines:
+        if line.startswith(('G0', 'G1')):
+            tokens = []
+            for part in line.split():
+                if part.startswith(('X', 'Y')):
+                    tokens.append(part[0])
+                    pieces.append(' '.join(tokens).encode())
+                    length += len(pieces[-1])
+                    positions.append(length)
+                    values.append(float(part[1:]))
+                    is_x.append(part[0] == 'X')
+                    tokens = ['']
+                else:
+                    tokens.append(part)
+            line = ' '.join(tokens) + '\n'
+        pieces.append(line.encode())
+        length += len(pieces[-1])
+    stats.feed(''.join(lines))
+    return (b''.join(pieces), np.array(positions, dtype=np.int64),
+            np.array(values, dtype=np.float64), np.array(is_x, dtype=bool))
+
+def _iter_compiled_chunks(input_file_path, engine, stats):
+    if engine == 'fast':
+        with open(input_file_path, 'rb') as infile:
+            for chunk in read_line_chunks(infile):
+                yield _compile_chunk_fast(chunk, stats)
+    else:
+        with open(input_file_path, 'r', buffering=TRANSLATE_BUFFER_SIZE) as infile:
+            while True:
+                lines = infile.readlines(TRANSLATE_BUFFER_SIZE)
+                if not lines:
+                    break
+                yield _compile_lines_legacy(lines, stats)
+
+def compile_template(input_file_path, engine='legacy'):
+    # The file is analyzed while it is compiled, see OffsetTemplate.write
+    if engine not in TRANSLATE_ENGINES:
+        raise ValueError(f"Unknown translation engine: {engine}. Expected one of {', '.join(TRANSLATE_ENGINES)}")
+
+    texts = []
+    positions = []
+    values = []
+    is_x = []
+    text_length = 0
+    stats = TranslationStats()
+    for text, chunk_positions, chunk_values, chunk_is_x in _iter_compiled_chunks(input_file_path, engine, stats):
+        texts.append(text)
+        positions.append(chunk_positions + text_length)
+        values.append(chunk_values)
+        is_x.append(chunk_is_x)
+        text_length += len(text)
+    stats.finish()
+
+    if not texts:
+        return OffsetTemplate(b'', np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=bool), engine, stats)
+    return OffsetTemplate(b''.join(texts), np.concatenate(positions), np.concatenate(values), np.concatenate(is_x), engine, stats)
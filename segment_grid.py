@@ -0,0 +1,110 @@
+import numpy as np
+
+# Cells along the longer side of the finest grid level
+SEGMENT_GRID_CELLS = 256
+
+# Runs of visible segments separated by at most this many hidden ones are
+# drawn as one polyline, trading a few clipped segments for fewer draw calls
+RUN_MERGE_GAP = 16
+
+# Segments handled per step while building, between checks for cancellation
+BUILD_BLOCK_SIZE = 1 << 20
+
+class SegmentGrid:
+    # Spatial index over the segments of a toolpath, segment i being the line
+    # from move i to move i + 1. It is a loose grid with several levels: level
+    # k has cells of cell_size * 2**k, and every segment is stored once, in the
+    # finest level whose cells are at least as large as the segment, under the
+    # cell holding its lower-left corner. A segment can therefore reach at most
+    # one cell to the right and up from where it is stored, and a query widens
+    # the region by one cell on the other side to find it. Each level keeps its
+    # segments sorted by cell, so the segments of a row of cells are one slice.
+
+    def __init__(self, points, cells=SEGMENT_GRID_CELLS, cancelled=None):
+        # cancelled, when given, is called between the steps of the build,
+        # which stops as soon as it returns True. The grid then has no
+        # segments and a count of None, so it never stands in for the points.
+        self.count = len(points)
+        self.levels = []  # (cell size, columns, rows, segments sorted by cell, first segment of each cell)
+        self.origin = (0.0, 0.0)
+        if len(points) < 2:
+            return
+
+        # The passes over all segments go a block at a time, so a cancelled
+        # build stops after at most one block
+        def blocks(count):
+            for start in range(0, count, BUILD_BLOCK_SIZE):
+                if cancelled is not None and cancelled():
+                    self.count = None
+                    self.levels = []
+                    return
+                yield start, min(start + BUILD_BLOCK_SIZE, count)
+
+        lows = np.empty((len(points) - 1, 2), dtype=np.float64)
+        sizes = np.empty(len(points) - 1, dtype=np.float64)
+        for start, end in blocks(len(sizes)):
+            block = points[start:end + 1].astype(np.float64)
+            np.minimum(block[:-1], block[1:], out=lows[start:end])
+            np.abs(block[1:] - block[:-1]).max(axis=1, out=sizes[start:end])
+        if self.count is None:
+            return
+
+        origin = lows.min(axis=0)
+        extent = np.maximum(points.max(axis=0).astype(np.float64) - origin, 0.0)
+        cell_size = max(float(extent.max()) / cells, 1e-3)
+        self.origin = (float(origin[0]), float(origin[1]))
+
+        levels = np.empty(len(sizes), dtype=np.int8)
+        for start, end in blocks(len(levels)):
+            lows[start:end] -= origin
+            levels[start:end] = np.ceil(np.log2(np.maximum(sizes[start:end] / cell_size, 1.0)))
+        del sizes
+        if self.count is None:
+            return
+        for level in np.unique(levels).tolist():
+            size = cell_size * 2.0 ** level
+            columns = int(extent[0] // size) + 1
+            rows = int(extent[1] // size) + 1
+            segments = np.flatnonzero(levels == level).astype(np.int32)
+            # Small keys sort much faster, 16-bit ones with a radix sort
+            keys = np.empty(len(segments), dtype=np.uint16 if rows * columns <= 1 << 16 else np.int32)
+            for start, end in blocks(len(segments)):
+                cell_xy = np.minimum((lows[segments[start:end]] // size).astype(np.int64), (columns - 1, rows - 1))
+                keys[start:end] = cell_xy[:, 1] * columns + cell_xy[:, 0]
+            if self.count is None:
+                return
+            order = np.argsort(keys, kind='stable')
+            cell_starts = np.searchsorted(keys[order], np.arange(rows * columns + 1))
+            self.levels.append((size, columns, rows, segments[order], cell_starts))
+
+    def query(self, min_x, min_y, max_x, max_y):
+        # Sorted indices of the segments that may cross the region. Every
+        # segment that does is included, along with some close to it.
+        found = []
+        origin_x, origin_y = self.origin
+        for size, columns, rows, segments, cell_starts in self.levels:
+            first_column = max(int((min_x - origin_x) // size) - 1, 0)
+            last_column = min(int((max_x - origin_x) // size), columns - 1)
+            first_row = max(int((min_y - origin_y) // size) - 1, 0)
+            last_row = min(int((max_y - origin_y) // size), rows - 1)
+            if first_column > last_column or first_row > last_row:
+                continue
+            for row in range(first_row, last_row + 1):
+                start = cell_starts[row * columns + first_column]
+                end = cell_starts[row * columns + last_column + 1]
+                if end > start:
+                    found.append(segments[start:end])
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        return np.sort(np.concatenate(found))
+
+    def visible_runs(self, min_x, min_y, max_x, max_y, max_gap=RUN_MERGE_GAP):
+        # The segments found by query() as runs of consecutive moves: a list of
+        # (first move, last move) pairs, each to be drawn as one polyline
+        segments = self.query(min_x, min_y, max_x, max_y)
+        if not len(segments):
+            return []
+        breaks = np.flatnonzero(np.diff(segments) > max_gap + 1)
+        firsts = segments[np.concatenate(([0], breaks + 1))]
+        lasts = segments[np.concatenate((breaks, [len(segments) - 1]))] + 1
+        return list(zip(firsts.tolist(), lasts.tolist()))
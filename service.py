@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import configparser
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from aiohttp import web
+
+import metrics
+from main import (create_default_config, configure_metrics, connect_to_printer, disconnect_from_printer, upload_file, start_print,
+                  fixed_file_name, printer_file_name, UPLOAD_CONCURRENCY, UPLOAD_RETRIES)
+from gcode_translate import parse_bed_size, summary_fits_bed, describe_summary, translate_in_worker, TRANSLATE_ENGINES, TRANSLATE_BUFFER_SIZE
+
+# Local translation daemon. Workstations POST a G-code file to /translate and
+# either get the translated file streamed back or have it forwarded to the
+# printer, instead of copying it into fixme and waiting for the watcher.
+#
+#   curl -F file=@part.gcode 'http://localhost:8765/translate?x_offset=80&y_offset=80' -o part-fixed.gcode
+#   curl --data-binary @part.gcode 'http://localhost:8765/translate?filename=part.gcode&forward=true'
+#
+# Uploads are spooled to disk and translated on a pool of worker processes.
+# At most workers + queue_size requests are admitted at a time; further ones
+# are turned away with 503 and a Retry-After header right away instead of
+# piling up uploads on disk.
+
+SERVICE_RETRY_AFTER = 5
+
+class TranslationService:
+    def __init__(self, config, workers, queue_size, spool_directory=None):
+        self.x_offset = config.getfloat('Offsets', 'x_offset')
+        self.y_offset = config.getfloat('Offsets', 'y_offset')
+        self.engine = config.get('Script', 'translate_engine', fallback='legacy')
+        self.translate_workers = config.getint('Script', 'translate_workers', fallback=1)
+        self.bed_size = parse_bed_size(config.get('Script', 'bed_size', fallback='220x220')) \
+            if config.getboolean('Script', 'bed_check', fallback=True) else None
+        self.moonraker_url = config.get('Moonraker', 'url')
+        self.upload_concurrency = config.getint('Moonraker', 'upload_concurrency', fallback=UPLOAD_CONCURRENCY)
+        self.upload_retries = config.getint('Moonraker', 'upload_retries', fallback=UPLOAD_RETRIES)
+        self.spool_directory = spool_directory or None
+
+        self.capacity = workers + queue_size
+        self.active = 0
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.client = None
+        self._connect_lock = asyncio.Lock()
+
+    async def get_client(self):
+        # One connection to Moonraker is shared by all forwarded requests and
+        # opened again when it was lost
+        async with self._connect_lock:
+            if self.client is None:
+                self.client = await connect_to_printer(self.moonraker_url, self.upload_concurrency, self.upload_retries)
+            return self.client
+
+    async def close(self):
+        self.executor.shutdown()
+        if self.client:
+            await disconnect_from_printer(self.client)
+
+    def _query_float(self, request, name, default):
+        try:
+            return float(request.query.get(name, default))
+        except ValueError:
+            raise web.HTTPBadRequest(text=f"{name} must be a number\n")
+
+    async def handle_translate(self, request):
+        if self.active >= self.capacity:
+            raise web.HTTPServiceUnavailable(text="Too many translations in progress, try again later\n",
+                                             headers={'Retry-After': str(SERVICE_RETRY_AFTER)})
+        self.active += 1
+        try:
+            return await self._translate(request)
+        finally:
+            self.active -= 1
+            metrics.recorder.write_prometheus()
+
+    async def _translate(self, request):
+        x_offset = self._query_float(request, 'x_offset', self.x_offset)
+        y_offset = self._query_float(request, 'y_offset', self.y_offset)
+        engine = request.query.get('engine', self.engine)
+        if engine not in TRANSLATE_ENGINES:
+            raise web.HTTPBadRequest(text=f"engine must be one of {', '.join(TRANSLATE_ENGINES)}\n")
+        forward = request.query.get('forward', 'false').lower() == 'true'
+        print_after = request.query.get('start_print', 'false').lower() == 'true'
+
+        work_directory = tempfile.mkdtemp(prefix='canvass-', dir=self.spool_directory)
+        try:
+            input_name = await self._spool_upload(request, work_directory)
+            input_file_path = os.path.join(work_directory, input_name)
+            new_filename = fixed_file_name(input_name, x_offset, y_offset)
+            output_file_path = os.path.join(work_directory, new_filename)
+
+            loop = asyncio.get_running_loop()
+            summary, records = await loop.run_in_executor(
+                self.executor, translate_in_worker, metrics.recorder.profile_directory, input_file_path,
+                output_file_path, x_offset, y_offset, engine, self.translate_workers, self.bed_size is not None)
+            metrics.recorder.replay(records)
+            logging.info(f"Translated {input_name} -> {new_filename} for {request.remote}")
+
+            if summary is not None:
+                logging.info(f"{new_filename}: {describe_summary(summary)}")
+                if not summary_fits_bed(summary, self.bed_size):
+                    return web.json_response({'error': f"{new_filename} goes off the {self.bed_size[0]:g}x{self.bed_size[1]:g} mm bed",
+                                              'summary': summary}, status=422)
+
+            if forward:
+                return await self._forward(output_file_path, new_filename, print_after, summary)
+            return await self._stream_back(request, output_file_path, new_filename)
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, work_directory, True)
+
+    async def _spool_upload(self, request, work_directory):
+        # Write the request body to disk as it arrives, either the 'file' field
+        # of a multipart form (like Moonraker's own upload endpoint) or a raw
+        # body named by the filename query parameter
+        if request.content_type.startswith('multipart/'):
+            reader = await request.multipart()
+            while True:
+                field = await reader.next()
+                if field is None:
+                    raise web.HTTPBadRequest(text="Missing 'file' field\n")
+                if field.name == 'file':
+                    break
+            file_name = field.filename or 'upload.gcode'
+            chunks = _iter_field(field)
+        else:
+            file_name = request.query.get('filename', 'upload.gcode')
+            chunks = request.content.iter_chunked(TRANSLATE_BUFFER_SIZE)
+
+        file_name = printer_file_name(os.path.basename(file_name)).strip('.') or 'upload.gcode'
+        loop = asyncio.get_running_loop()
+        with open(os.path.join(work_directory, file_name), 'wb') as file:
+            async for chunk in chunks:
+                await loop.run_in_executor(None, file.write, chunk)
+        return file_name
+
+    async def _forward(self, output_file_path, new_filename, print_after, summary):
+        client = await self.get_client()
+        if client is None:
+            raise web.HTTPBadGateway(text=f"Could not connect to Moonraker at {self.moonraker_url}\n")
+        try:
+            uploaded = await upload_file(client, output_file_path)
+            if uploaded and print_after:
+                await start_print(client, printer_file_name(new_filename))
+        except Exception as e:
+            # Drop the connection so the next request opens a fresh one
+            logging.error(f"Failed to forward {new_filename} to Moonraker: {e}")
+            self.client = None
+            try:
+                await disconnect_from_printer(client)
+            except Exception:
+                pass
+            raise web.HTTPBadGateway(text=f"Failed to forward to Moonraker: {e}\n")
+        if not uploaded:
+            raise web.HTTPBadGateway(text="Moonraker rejected the upload, see the service log\n")
+        return web.json_response({'file': printer_file_name(new_filename), 'uploaded': True,
+                                  'print_started': print_after, 'summary': summary})
+
+    async def _stream_back(self, request, output_file_path, new_filename):
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/x-gcode',
+            'Content-Disposition': f'attachment; filename="{new_filename}"',
+        })
+        response.content_length = os.path.getsize(output_file_path)
+        await response.prepare(request)
+        loop = asyncio.get_running_loop()
+        with open(output_file_path, 'rb') as file:
+            while True:
+                chunk = await loop.run_in_executor(None, file.read, TRANSLATE_BUFFER_SIZE)
+                if not chunk:
+                    break
+                # Waits while the client is slow to read
+                await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def handle_health(self, request):
+        return web.json_response({'active': self.active, 'capacity': self.capacity})
+
+async def _iter_field(field):
+    while True:
+        chunk = await field.read_chunk(TRANSLATE_BUFFER_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+def create_app(service):
+    app = web.Application()
+    app.router.add_post('/translate', service.handle_translate)
+    app.router.add_get('/health', service.handle_health)
+
+    async def close_service(app):
+        await service.close()
+
+    app.on_cleanup.append(close_service)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve G-code translation over HTTP for other machines on the network.")
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--host', help="Address to listen on (default from [Service] host)")
+    parser.add_argument('--port', type=int, help="Port to listen on (default from [Service] port)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.config):
+        create_default_config(args.config)
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    host = args.host or config.get('Service', 'host', fallback='127.0.0.1')
+    port = args.port or config.getint('Service', 'port', fallback=8765)
+    workers = config.getint('Service', 'workers', fallback=2)
+    queue_size = config.getint('Service', 'queue_size', fallback=8)
+    spool_directory = config.get('Service', 'spool_directory', fallback='')
+    configure_metrics(config)
+
+    logging.info(f"Serving translations on http://{host}:{port} with {workers} workers and room for {queue_size} more requests")
+
+    async def make_app():
+        return create_app(TranslationService(config, workers, queue_size, spool_directory))
+
+    web.run_app(make_app(), host=host, port=port, access_log=None)
+
+if __name__ == "__main__":
+    main()
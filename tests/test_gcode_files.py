@@ -0,0 +1,13 @@
+from gcode_files import move_gcode_file, SIDECAR_SUFFIXES
+
+def test_move_gcode_file_takes_sidecars_along(tmp_path):
+    (tmp_path / 'processed').mkdir()
+    source = tmp_path / 'part.gcode'
+    source.write_text('G1 X1 Y1\n')
+    (tmp_path / 'part.gcode.moves').write_bytes(b'moves')
+
+    move_gcode_file(str(source), str(tmp_path / 'processed' / 'part.gcode'))
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['processed']
+    assert sorted(path.name for path in (tmp_path / 'processed').iterdir()) == ['part.gcode', 'part.gcode.moves']
+    assert '.layers.json' in SIDECAR_SUFFIXES
@@ -0,0 +1,58 @@
+import math
+
+import numpy as np
+import pytest
+
+from move_fields import MoveFields, parse_numbers, format_numbers
+
+def _parse(words):
+    # parse_numbers over the words of a space separated buffer
+    text = b' '.join(words)
+    starts = np.cumsum([0] + [len(word) + 1 for word in words[:-1]])
+    ends = starts + [len(word) for word in words]
+    return parse_numbers(np.frombuffer(text, dtype=np.uint8), starts, ends)
+
+def _format(values):
+    numbers, lengths = format_numbers(np.array(values, dtype=np.float64))
+    texts = []
+    start = 0
+    for length in lengths.tolist():
+        texts.append(numbers[start:start + length].tobytes())
+        start += length
+    return texts
+
+def test_parse_numbers_matches_float():
+    words = [b'0', b'1', b'-1.5', b'+2.25', b'.5', b'5.', b'-.125', b'+0', b'007.100',
+             b'123456789012345', b'1234567890123456', b'-12345.6789012345678', b'0.1000000000000000055511']
+    values = _parse(words)
+    assert values.tolist() == [float(word) for word in words]
+
+def test_parse_numbers_keeps_the_sign_of_zero():
+    values = _parse([b'-0.000', b'-0', b'0.000', b'+0.0'])
+    assert values.tolist() == [0.0, 0.0, 0.0, 0.0]
+    assert np.signbit(values).tolist() == [True, True, False, False]
+
+@pytest.mark.parametrize('word', [b'1.2.3', b'.', b'-', b'+.'])
+def test_parse_numbers_rejects_malformed_numbers(word):
+    with pytest.raises(ValueError):
+        _parse([b'1', word])
+
+def test_format_numbers_matches_percent_format():
+    values = [0.0, -0.0, -0.0004, 0.0004, 0.0005, -0.0005, 1.0005, 2.675, -1.2345, 0.9995, 999.9995,
+              123456789.1234, -98765.4321, 1e14 + 0.125, 1e15, -1e20, math.nan, math.inf, -math.inf]
+    assert _format(values) == [b'%.3f' % value for value in values]
+
+def test_format_numbers_of_random_values():
+    values = np.random.default_rng(1).uniform(-1000, 1000, 20000).round(4)
+    assert _format(values) == [b'%.3f' % value for value in values.tolist()]
+
+def test_format_numbers_of_nothing():
+    numbers, lengths = format_numbers(np.empty(0))
+    assert len(numbers) == 0 and len(lengths) == 0
+
+def test_positions_follow_the_axis_of_each_field():
+    fields = MoveFields(b'G1 X1 X2\nG1 Y5 E1\nG0 X3 Y4\nG1 Z2\nG1 Y7 X8\n')
+    xs, ys = fields.positions(fields.values())
+    assert np.isnan(xs[1]) and np.isnan(ys[0])
+    assert xs[[2, 3]].tolist() == [3.0, 8.0]
+    assert ys[1:].tolist() == [5.0, 4.0, 7.0]
@@ -0,0 +1,34 @@
+import asyncio
+import logging
+
+import main
+
+def test_reconnect_adds_printers_when_none_answered_at_startup(monkeypatch):
+    async def connect_to_printers(printers, upload_concurrency, upload_retries):
+        return {name: object() for name in printers}
+
+    monkeypatch.setattr(main, 'connect_to_printers', connect_to_printers)
+
+    async def run():
+        clients = {}
+        task = asyncio.create_task(main.reconnect_printers({'left': 'http://left:7125'}, clients, interval=0))
+        while not clients:
+            await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return clients
+
+    assert list(asyncio.run(run())) == ['left']
+
+def test_file_without_online_printers_logs_why(tmp_path, caplog):
+    input_directory = tmp_path / 'fixme'
+    input_directory.mkdir()
+    (input_directory / 'part.gcode').write_text('G1 X1 Y1 E1\n')
+    output_directory = tmp_path / 'fixed'
+    output_directory.mkdir()
+
+    with caplog.at_level(logging.INFO):
+        asyncio.run(main.process_file(str(input_directory), str(output_directory), 'part.gcode', 80.0, 80.0, False, {}, True, True, 'fast'))
+
+    assert 'No printer is online' in caplog.text
+    assert 'Auto-upload is disabled' not in caplog.text
@@ -0,0 +1,36 @@
+import numpy as np
+
+import segment_grid
+from segment_grid import SegmentGrid
+
+def _crossing(points, min_x, min_y, max_x, max_y):
+    # Segments whose bounding box overlaps the region, found the slow way
+    starts, ends = points[:-1], points[1:]
+    lows, highs = np.minimum(starts, ends), np.maximum(starts, ends)
+    return set(np.flatnonzero((lows[:, 0] <= max_x) & (highs[:, 0] >= min_x) & (lows[:, 1] <= max_y) & (highs[:, 1] >= min_y)).tolist())
+
+def test_query_finds_every_segment_in_region(monkeypatch):
+    # Small blocks so the build goes through several of them
+    monkeypatch.setattr(segment_grid, 'BUILD_BLOCK_SIZE', 1000)
+    rng = np.random.default_rng(0)
+    points = np.cumsum(rng.normal(0, 2, (20000, 2)), axis=0).astype(np.float32)
+    grid = SegmentGrid(points, cells=64)
+    assert grid.count == len(points)
+    for _ in range(20):
+        min_x, min_y = rng.uniform(points.min(axis=0), points.max(axis=0))
+        region = (min_x, min_y, min_x + rng.uniform(1, 50), min_y + rng.uniform(1, 50))
+        assert _crossing(points, *region) <= set(grid.query(*region).tolist())
+
+def test_cancelled_build_stops(monkeypatch):
+    monkeypatch.setattr(segment_grid, 'BUILD_BLOCK_SIZE', 1000)
+    points = np.random.default_rng(0).uniform(0, 100, (20000, 2)).astype(np.float32)
+    checks = []
+
+    def cancelled():
+        checks.append(True)
+        return len(checks) > 3
+
+    grid = SegmentGrid(points, cancelled=cancelled)
+    assert grid.count is None
+    assert grid.levels == []
+    assert len(checks) == 4
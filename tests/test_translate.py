@@ -0,0 +1,112 @@
+import multiprocessing
+import re
+
+import pytest
+
+import gcode_translate
+from gcode_translate import translate_gcode, TRANSLATE_ENGINES
+from offset_template import compile_template
+
+# The G0/G1 X/Y fields the fast engine rewrites, as documented in move_fields
+_MOVE_RE = re.compile(rb'(?m)^(G0?[01](?![0-9.])[^\n;XY]*)([XY])([-+]?[\d.]+)(?:([^\n;XY]*)([XY])([-+]?[\d.]+))?')
+
+# Lines both engines translate alike
+LINES = [
+    b'; generated for the tests, G1 X1 Y1',
+    b'G28',
+    b'G1 Z0.2 F3000',
+    b'G1 X10 Y-5.5 E0.1',
+    b'G0 F3000 X.5 Y+2',
+    b'G01 X1 Y2',
+    b'G00 Y3.25 X-4',
+    b'G1 Y-12.0004 E1',
+    b'G1 X123.4567890123456789 Y7',
+    b'T1',
+    b'G1 Z0.4',
+    b'G1 X0.0005 Y-0.0005 E0.3',
+]
+# Lines the legacy engine, which takes any line starting with G0/G1 for a
+# move, splits it on whitespace and calls float() on every X/Y word,
+# translates differently or not at all
+FAST_ONLY_LINES = [
+    b'G10 X1 Y1',
+    b'G1X5Y6E.2',
+    b'G1 X1 X2 Y3',
+    b'G1 X7 ; Y5 is a comment',
+    b'G1 X Y5',
+    b'G1 X1 Y1e5',
+]
+
+def _reference(data, x_offset, y_offset):
+    # The fast engine's output computed one regular expression match at a time
+    def field(axis, value):
+        return axis + b'%.3f' % (float(value) + (x_offset if axis == b'X' else y_offset))
+
+    def replace(match):
+        text = match.group(1) + field(match.group(2), match.group(3))
+        if match.group(5) is not None:
+            text += match.group(4) + field(match.group(5), match.group(6))
+        return text
+
+    header = f"; Translated with offsets: X={x_offset}mm, Y={y_offset}mm\n".encode()
+    return header + _MOVE_RE.sub(replace, data)
+
+def _write_gcode(path, lines):
+    path.write_bytes(b'\n'.join(lines * 50) + b'\n')
+    return path
+
+@pytest.fixture
+def gcode_file(tmp_path):
+    return _write_gcode(tmp_path / 'part.gcode', LINES + FAST_ONLY_LINES)
+
+@pytest.fixture
+def engine_gcode_file(tmp_path, engine):
+    return _write_gcode(tmp_path / 'part.gcode', LINES if engine == 'legacy' else LINES + FAST_ONLY_LINES)
+
+def _rounded(summary, engine):
+    # The legacy engine analyzes its output text, where coordinates are
+    # rounded to thousandths; the others analyze the translated values
+    if engine == 'legacy':
+        summary = dict(summary, bounds=[round(value, 3) for value in summary['bounds']])
+    return summary
+
+@pytest.mark.parametrize('offsets', [(12.5, -3.25), (0, 0), (-0.0004, 100)])
+def test_fast_engine_matches_reference(gcode_file, tmp_path, offsets):
+    output_file_path = tmp_path / 'part-FIXED.gcode'
+    translate_gcode(str(gcode_file), str(output_file_path), *offsets, engine='fast')
+    assert output_file_path.read_bytes() == _reference(gcode_file.read_bytes(), *offsets)
+
+def test_engines_agree_on_common_lines(tmp_path):
+    gcode_file = _write_gcode(tmp_path / 'part.gcode', LINES)
+    outputs = []
+    for engine in TRANSLATE_ENGINES:
+        output_file_path = tmp_path / f'part-{engine}.gcode'
+        translate_gcode(str(gcode_file), str(output_file_path), 12.5, -3.25, engine=engine)
+        outputs.append(output_file_path.read_bytes())
+    assert outputs[0] == outputs[1]
+
+@pytest.mark.parametrize('engine', TRANSLATE_ENGINES)
+def test_template_matches_translate_gcode(engine_gcode_file, tmp_path, engine):
+    template = compile_template(str(engine_gcode_file), engine)
+    for offsets in [(12.5, -3.25), (-100, 0.001)]:
+        translated_path = tmp_path / 'translated.gcode'
+        rendered_path = tmp_path / 'rendered.gcode'
+        summary = translate_gcode(str(engine_gcode_file), str(translated_path), *offsets, engine=engine, analyze=True)
+        assert _rounded(template.write(str(rendered_path), *offsets, analyze=True), engine) == _rounded(summary, engine)
+        assert rendered_path.read_bytes() == translated_path.read_bytes()
+
+@pytest.mark.parametrize('start_method', [None, 'spawn'])
+@pytest.mark.parametrize('engine', TRANSLATE_ENGINES)
+def test_parallel_matches_serial(engine_gcode_file, tmp_path, monkeypatch, engine, start_method):
+    serial_path = tmp_path / 'serial.gcode'
+    parallel_path = tmp_path / 'parallel.gcode'
+    summary = translate_gcode(str(engine_gcode_file), str(serial_path), 12.5, -3.25, engine=engine, analyze=True)
+
+    # Split the small file into many ranges, cut mid-layer
+    split_line_ranges = gcode_translate._split_line_ranges
+    monkeypatch.setattr(gcode_translate, 'PARALLEL_MIN_SIZE', 0)
+    monkeypatch.setattr(gcode_translate, '_split_line_ranges', lambda path: split_line_ranges(path, 1000))
+    mp_context = multiprocessing.get_context(start_method) if start_method else None
+    assert translate_gcode(str(engine_gcode_file), str(parallel_path), 12.5, -3.25, engine=engine, workers=2, analyze=True,
+                           mp_context=mp_context) == summary
+    assert parallel_path.read_bytes() == serial_path.read_bytes()
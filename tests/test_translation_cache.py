@@ -0,0 +1,34 @@
+from translation_cache import TranslationCache
+
+def test_writing_a_fixed_file_does_not_change_the_cache(tmp_path):
+    cache = TranslationCache(str(tmp_path / 'cache'), 1 << 20)
+    output_file_path = tmp_path / 'part-FIXED.gcode'
+    output_file_path.write_bytes(b'; X=100.04mm\nG1 X1 Y2\n')
+    cache.store('key', str(output_file_path))
+
+    # A later run without the cache writes the same file name in place
+    with open(output_file_path, 'w') as file:
+        file.write('; X=100.01mm\n')
+
+    assert cache.lookup('key', str(output_file_path))
+    assert output_file_path.read_bytes() == b'; X=100.04mm\nG1 X1 Y2\n'
+
+def test_changed_entry_is_a_miss(tmp_path):
+    cache = TranslationCache(str(tmp_path / 'cache'), 1 << 20)
+    output_file_path = tmp_path / 'part-FIXED.gcode'
+    output_file_path.write_bytes(b'G1 X1 Y2\n')
+    cache.store('key', str(output_file_path))
+    (tmp_path / 'cache' / 'key.gcode').write_bytes(b'G1 X9 Y9\n')
+
+    assert not cache.lookup('key', str(output_file_path))
+    assert output_file_path.read_bytes() == b'G1 X1 Y2\n'
+    assert not cache.lookup('key', str(output_file_path))
+
+def test_entry_without_summary_is_a_miss_when_one_is_needed(tmp_path):
+    cache = TranslationCache(str(tmp_path / 'cache'), 1 << 20)
+    output_file_path = tmp_path / 'part-FIXED.gcode'
+    output_file_path.write_bytes(b'G1 X300 Y2\n')
+    cache.store('key', str(output_file_path), summary=None)
+
+    assert not cache.lookup('key', str(output_file_path), need_summary=True)
+    assert cache.lookup('key', str(output_file_path))
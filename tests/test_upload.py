@@ -0,0 +1,77 @@
+import asyncio
+import time
+import types
+
+import pytest
+
+import main
+from gcode_translate import translate_gcode
+from main import upload_translated, _attach_upload_pool, _create_http_session, _printer_has_file
+from mock_moonraker import start_mock_moonraker
+
+def _write_gcode(path, layers=40, moves_per_layer=500):
+    lines = ['G28', 'T0']
+    for layer in range(layers):
+        lines.append(f'G1 Z{0.2 * (layer + 1):.1f}')
+        for move in range(moves_per_layer):
+            lines.append(f'G1 X{move % 100 + 0.5:.3f} Y{layer + move / 1000:.3f} E0.0{move % 9 + 1}')
+    path.write_text('\n'.join(lines) + '\n')
+
+async def _upload(input_file_path, output_file_path, cancel_after_first_chunk=False):
+    # Upload to a local stand-in server, cancelling the upload once its first
+    # chunk went out when asked to. Returns the upload result, or the
+    # exception the upload ended with, and whether the server got the file.
+    runner, base_url = await start_mock_moonraker()
+    client = types.SimpleNamespace(_base_url=base_url)
+    _attach_upload_pool(client, _create_http_session(1))
+    try:
+        task = None
+
+        def progress(sent, total):
+            if cancel_after_first_chunk:
+                task.cancel()
+
+        task = asyncio.ensure_future(upload_translated(client, str(input_file_path), str(output_file_path), 80.0, 80.0, 'fast', progress=progress))
+        try:
+            result = await task
+        except BaseException as e:
+            result = e
+        size = output_file_path.stat().st_size
+        received = await _printer_has_file(client, output_file_path.name, size)
+        return result, received
+    finally:
+        await client.session.close()
+        await runner.cleanup()
+
+def test_upload_translated_sends_and_keeps_translated_file(tmp_path):
+    input_file_path = tmp_path / 'part.gcode'
+    _write_gcode(input_file_path)
+    translate_gcode(str(input_file_path), str(tmp_path / 'expected.gcode'), 80.0, 80.0, engine='fast')
+
+    result, received = asyncio.run(_upload(input_file_path, tmp_path / 'part-fixed.gcode'))
+
+    assert result is True
+    assert received
+    assert (tmp_path / 'part-fixed.gcode').read_bytes() == (tmp_path / 'expected.gcode').read_bytes()
+
+def test_cancelled_upload_translated_finishes_local_copy(tmp_path, monkeypatch):
+    input_file_path = tmp_path / 'part.gcode'
+    _write_gcode(input_file_path)
+    translate_gcode(str(input_file_path), str(tmp_path / 'expected.gcode'), 80.0, 80.0, engine='fast')
+
+    # Slow the translation down so the cancellation arrives while a worker
+    # thread is inside it
+    iter_translated_chunks = main.iter_translated_chunks
+
+    def slow_chunks(*args, **kwargs):
+        for chunk in iter_translated_chunks(*args, **kwargs):
+            time.sleep(0.02)
+            yield chunk
+
+    monkeypatch.setattr(main, 'iter_translated_chunks', slow_chunks)
+
+    result, received = asyncio.run(_upload(input_file_path, tmp_path / 'part-fixed.gcode', cancel_after_first_chunk=True))
+
+    assert isinstance(result, asyncio.CancelledError)
+    assert not received
+    assert (tmp_path / 'part-fixed.gcode').read_bytes() == (tmp_path / 'expected.gcode').read_bytes()
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+class TranslationCache:
+    # Content-addressed store of translated files. Entries are keyed on a hash
+    # of the input bytes plus everything that changes the output (offsets,
+    # engine and compression), and the least recently used ones are evicted
+    # once the cache grows beyond max_bytes. Entries are copied in and out,
+    # never linked, so writing to a fixed file cannot change the cache, and
+    # an entry whose size or hash no longer matches is dropped on lookup.
+
+    def __init__(self, cache_directory, max_bytes):
+        self.cache_directory = cache_directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_directory, 'index.json')
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_directory, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable translation cache index {self.index_path}: {e}")
+            return {}
+
+    def _save_index(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.index, file, indent=1)
+        os.replace(temp_path, self.index_path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_directory, f"{key}.gcode")
+
+    @staticmethod
+    def make_key(input_file_path, x_offset, y_offset, engine, compression=None):
+        digest = hashlib.sha256()
+        with open(input_file_path, 'rb') as file:
+            while True:
+                block = file.read(_HASH_BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+        digest.update(f"|{x_offset!r}|{y_offset!r}|{engine}".encode())
+        if compression:
+            # Entries hold the output as stored, compressed or not
+            digest.update(f"|{compression}".encode())
+        return digest.hexdigest()
+
+    def lookup(self, key, output_file_path, need_summary=False):
+        # Place the cached output at output_file_path and return True on a hit.
+        # With need_summary, entries stored without a summary are misses.
+        entry = self.index.get(key)
+        entry_path = self._entry_path(key)
+        if entry is None or not os.path.exists(entry_path) or (need_summary and entry.get('summary') is None):
+            self.misses += 1
+            return False
+
+        temp_path = output_file_path + '.tmp'
+        try:
+            size, digest = _copy_and_hash(entry_path, temp_path)
+        except OSError as e:
+            logging.warning(f"Could not read {key[:12]} from the translation cache: {e}")
+            size, digest = None, None
+        if size != entry['size'] or digest != entry.get('sha256'):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            logging.warning(f"Dropping {key[:12]} from the translation cache, it no longer matches what was stored")
+            self._remove(key)
+            self._save_index()
+            self.misses += 1
+            return False
+        os.replace(temp_path, output_file_path)
+        entry['last_used'] = time.time()
+        self._save_index()
+        self.hits += 1
+        return True
+
+    def store(self, key, output_file_path, summary=None):
+        entry_path = self._entry_path(key)
+        temp_path = entry_path + '.tmp'
+        size, digest = _copy_and_hash(output_file_path, temp_path)
+        os.replace(temp_path, entry_path)
+        self.index[key] = {
+            'size': size,
+            'sha256': digest,
+            'last_used': time.time(),
+            'uploads': {},
+            'summary': summary,
+        }
+        self._evict()
+        self._save_index()
+
+    def summary(self, key):
+        # Analysis summary saved with the entry, if it was translated with one
+        entry = self.index.get(key)
+        return entry.get('summary') if entry is not None else None
+
+    def was_uploaded(self, key, printer, file_name):
+        entry = self.index.get(key)
+        return entry is not None and entry.get('uploads', {}).get(printer) == file_name
+
+    def record_upload(self, key, printer, file_name):
+        entry = self.index.get(key)
+        if entry is not None:
+            entry.setdefault('uploads', {})[printer] = file_name
+            self._save_index()
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda key: self.index[key]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]['size']
+            self._remove(key)
+            logging.info(f"Evicted {key[:12]} from the translation cache")
+
+    def _remove(self, key):
+        self.index.pop(key, None)
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def report(self):
+        return f"Translation cache: {self.hits} hits, {self.misses} misses"
+
+def _copy_and_hash(source_path, destination_path):
+    # Copy a file and return its size and SHA-256, read in the same pass
+    digest = hashlib.sha256()
+    size = 0
+    with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+        while True:
+            block = source.read(_HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            destination.write(block)
+            size += len(block)
+    return size, digest.hexdigest()
@@ -0,0 +1,131 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+
+from gcode_files import is_gcode_file
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+_READ_SIZE = 64 * 1024
+
+WATCH_BACKENDS = ('auto', 'inotify', 'polling')
+
+class InotifyWatcher:
+    def __init__(self, directory):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    async def read_events(self):
+        # Wait until the kernel has events for us, then return the names of all
+        # files that were closed after writing or moved into the directory.
+        # None is returned when the event queue overflowed and a rescan is needed.
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(self.fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+        finally:
+            loop.remove_reader(self.fd)
+
+        names = []
+        while True:
+            try:
+                data = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + name_length].rstrip(b'\0')
+                offset += name_length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if name:
+                    names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+def _list_gcode_files(directory):
+    return [filename for filename in os.listdir(directory) if is_gcode_file(filename)]
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+async def stable_files(directory, filenames, settle_time):
+    # Only keep files whose size and mtime did not change during settle_time,
+    # so files that are still being copied in are left for a later pass
+    before = {filename: _file_signature(os.path.join(directory, filename)) for filename in filenames}
+    if settle_time > 0:
+        await asyncio.sleep(settle_time)
+    return [filename for filename, signature in before.items()
+            if signature is not None and _file_signature(os.path.join(directory, filename)) == signature]
+
+def _create_inotify_watcher(directory, backend):
+    if backend == 'polling':
+        return None
+    if backend == 'auto' and not sys.platform.startswith('linux'):
+        return None
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError) as e:
+        if backend == 'inotify':
+            raise
+        logging.warning(f"inotify is not available ({e}). Falling back to polling.")
+        return None
+
+async def watch_directory(directory, watch_interval, backend='auto', settle_time=1.0):
+    # Yield lists of G-code files in directory that are completely written and
+    # ready to process. The first batch is whatever is already there.
+    if backend not in WATCH_BACKENDS:
+        raise ValueError(f"Unknown watch backend: {backend}. Expected one of {', '.join(WATCH_BACKENDS)}")
+
+    inotify = _create_inotify_watcher(directory, backend)
+    logging.info(f"Watching {directory} using {'inotify' if inotify else 'polling'}")
+    try:
+        yield await stable_files(directory, _list_gcode_files(directory), settle_time)
+
+        while True:
+            if inotify is None:
+                logging.info(f"Waiting {watch_interval} seconds before checking for new files...")
+                await asyncio.sleep(watch_interval)
+                yield await stable_files(directory, _list_gcode_files(directory), settle_time)
+                continue
+
+            names = await inotify.read_events()
+            if names is None:
+                logging.warning("inotify event queue overflowed. Rescanning the directory.")
+                yield await stable_files(directory, _list_gcode_files(directory), settle_time)
+                continue
+
+            # A close-write or move-in means the writer is done with the file
+            ready = sorted({name for name in names
+                            if is_gcode_file(name) and os.path.isfile(os.path.join(directory, name))})
+            if ready:
+                yield ready
+    finally:
+        if inotify:
+            inotify.close()